@@ -0,0 +1,502 @@
+import os
+import json
+import hashlib
+import zipfile
+import argparse
+import logging
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+from record_schema import column_type
+from work_catalog import media_ids
+
+MANIFEST_DIR = '_manifests'
+STATE_FILE = 'merged_runs.json'
+PARTS_DIR = 'parts'
+
+# Small row groups keep a point lookup to a few hundred KB of column chunks
+LOOKUP_ROW_GROUP_SIZE = 1024
+# Rows sorted in memory at once; larger outputs are sorted in media ID range passes
+SORT_MEMORY_ROWS = 250000
+# Scratch column holding each record's read order, so the first copy of a URL wins
+SEQ_COLUMN = '_seq'
+
+# A part file to merge, with the partition column values its rows lack
+Source = Tuple[Path, Dict[str, Optional[str]]]
+
+def setup_logging(level: int = logging.INFO) -> logging.Logger:
+    """Configure logging for the script"""
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def extract_artifacts(input_dir: Path, logger: logging.Logger) -> None:
+    """Extract every downloaded artifact.zip in place"""
+    for zip_path in sorted(input_dir.glob('*/artifact.zip')):
+        logger.info(f"Extracting {zip_path}")
+        with zipfile.ZipFile(zip_path) as zf:
+            zf.extractall(zip_path.parent)
+
+def file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def find_manifests(input_dir: Path) -> List[Tuple[Path, Dict]]:
+    """Every run manifest of the partitioned datasets under the input directory, oldest run first"""
+    manifests = []
+    for path in input_dir.rglob(f'{MANIFEST_DIR}/*.json'):
+        with open(path) as f:
+            manifests.append((path, json.load(f)))
+    return sorted(manifests, key=lambda item: (item[1].get('created_at', ''), item[1]['run_id']))
+
+def manifest_sources(manifest_path: Path, manifest: Dict, logger: logging.Logger) -> Optional[List[Source]]:
+    """Part files a manifest lists, or None when any of them is missing or fails its checksum"""
+    root = manifest_path.parent.parent
+    sources = []
+    for part in manifest['files']:
+        path = root / part['path']
+        if not path.exists():
+            logger.error(f"Run {manifest['run_id']}: {path} is missing")
+            return None
+        if path.stat().st_size != part['size'] or file_sha256(path) != part['sha256']:
+            logger.error(f"Run {manifest['run_id']}: {path} does not match its checksum")
+            return None
+        constants = {column: part['partition'].get(column) for column in manifest.get('partition_columns', [])}
+        sources.append((path, constants))
+    return sources
+
+def in_hive_partition(path: Path, input_dir: Path) -> bool:
+    return any('=' in part for part in path.relative_to(input_dir).parent.parts)
+
+def file_state(path: Path) -> Dict[str, int]:
+    """Size and modification time recorded for a merged plain parquet file"""
+    stat = path.stat()
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+def find_sources(input_dir: Path, logger: logging.Logger, merged_runs: Optional[Set[str]] = None,
+                 merged_files: Optional[Dict[str, Dict]] = None) -> Tuple[List[Source], List[str], Dict[str, Dict]]:
+    """Part files to merge, most rows first, with the run IDs and plain files they come from
+
+    Partitioned datasets are read through their manifests, skipping runs in
+    merged_runs; part files no manifest lists belong to runs that never
+    finished and are left out. Plain parquet files outside any dataset are
+    included unless merged_files records them (by path relative to
+    input_dir) with the same size and modification time. Reading the fullest
+    files first means older snapshots of the same segment are almost
+    entirely dropped as duplicates.
+    """
+    merged_runs = merged_runs or set()
+    merged_files = merged_files or {}
+    plain_files = {}
+    sources: List[Source] = []
+    run_ids = []
+    manifests = find_manifests(input_dir)
+    listed = {path.parent.parent / part['path'] for path, manifest in manifests for part in manifest['files']}
+    for manifest_path, manifest in manifests:
+        if manifest['run_id'] in merged_runs:
+            logger.debug(f"Run {manifest['run_id']} was merged before, skipping")
+            continue
+        run_sources = manifest_sources(manifest_path, manifest, logger)
+        if run_sources is None:
+            continue
+        sources.extend(run_sources)
+        run_ids.append(manifest['run_id'])
+        logger.info(f"Run {manifest['run_id']}: {manifest['rows']} records in {len(run_sources)} part file(s)")
+
+    unlisted = 0
+    for path in input_dir.rglob('*.parquet'):
+        if not in_hive_partition(path, input_dir):
+            key = str(path.relative_to(input_dir))
+            state = file_state(path)
+            if merged_files.get(key) == state:
+                logger.debug(f"{path} was merged before, skipping")
+                continue
+            sources.append((path, {}))
+            plain_files[key] = state
+        elif path not in listed:
+            unlisted += 1
+    if unlisted:
+        logger.warning(f"Ignoring {unlisted} part file(s) no manifest lists")
+    rows = {path: pq.ParquetFile(path).metadata.num_rows for path, _ in sources}
+    return sorted(sources, key=lambda source: (-rows[source[0]], str(source[0]))), run_ids, plain_files
+
+def source_schema(source: Source) -> pa.Schema:
+    """Schema of a part file with its partition columns restored to their record schema types"""
+    path, constants = source
+    schema = pq.read_schema(path)
+    for column in constants:
+        if column not in schema.names:
+            schema = schema.append(pa.field(column, column_type(column)))
+    return schema
+
+def unify_type(types: List[pa.DataType]) -> pa.DataType:
+    """Pick one type that every input type of a column can be cast to"""
+    if all(t == types[0] for t in types):
+        return types[0]
+    value_types = {t.value_type if pa.types.is_dictionary(t) else t for t in types}
+    value_types.discard(pa.null())
+    if len(value_types) == 1:
+        return value_types.pop()
+    if all(pa.types.is_integer(t) or pa.types.is_floating(t) for t in value_types):
+        return pa.float64()
+    return pa.string()
+
+def unify_schemas(schemas: List[pa.Schema]) -> pa.Schema:
+    """Union of all columns, with conflicting types widened to something castable"""
+    types: Dict[str, List[pa.DataType]] = {}
+    for schema in schemas:
+        for field in schema:
+            types.setdefault(field.name, []).append(field.type)
+    return pa.schema([(name, unify_type(column_types)) for name, column_types in types.items()])
+
+def conform(table: pa.Table, schema: pa.Schema, constants: Optional[Dict[str, Optional[str]]] = None) -> pa.Table:
+    """Cast a table to the unified schema, filling partition columns from constants and others it lacks with nulls"""
+    constants = constants or {}
+    columns = []
+    for field in schema:
+        if field.name in table.column_names:
+            column = table.column(field.name)
+            if column.type != field.type:
+                column = column.cast(field.type)
+        elif constants.get(field.name) is not None:
+            column = pa.array([constants[field.name]] * table.num_rows, type=pa.string()).cast(field.type)
+        else:
+            column = pa.nulls(table.num_rows, type=field.type)
+        columns.append(column)
+    return pa.Table.from_arrays(columns, schema=schema)
+
+def plain_schema(schema: pa.Schema) -> pa.Schema:
+    """Schema with dictionary columns decoded, for CSV output"""
+    return pa.schema([
+        (f.name, f.type.value_type if pa.types.is_dictionary(f.type) else f.type) for f in schema
+    ])
+
+class ColumnStats:
+    """Running processing time and media type totals over the tables it is fed"""
+
+    def __init__(self):
+        self.records = 0
+        self.time_sum = 0.0
+        self.time_count = 0
+        self.media_types: Dict[str, int] = {}
+
+    def add(self, table: pa.Table) -> None:
+        self.records += table.num_rows
+        if 'processing_time' in table.column_names:
+            times = table.column('processing_time')
+            self.time_sum += pc.sum(times).as_py() or 0.0
+            self.time_count += len(times) - times.null_count
+        if 'media_type' in table.column_names:
+            counts = pc.value_counts(table.column('media_type').cast(pa.string()))
+            for item in counts.to_pylist():
+                if item['values'] is not None:
+                    self.media_types[item['values']] = self.media_types.get(item['values'], 0) + item['counts']
+
+    def as_dict(self) -> Dict:
+        return {
+            'avg_processing_time': self.time_sum / self.time_count if self.time_count else 0.0,
+            'total_processing_time': self.time_sum,
+            'media_types': dict(sorted(self.media_types.items(), key=lambda kv: -kv[1])),
+        }
+
+def with_media_id(schema: pa.Schema) -> pa.Schema:
+    """Schema with an int64 media_id column right after url"""
+    if 'media_id' in schema.names:
+        schema = schema.remove(schema.get_field_index('media_id'))
+    return schema.insert(schema.get_field_index('url') + 1, pa.field('media_id', pa.int64()))
+
+def add_media_id(table: pa.Table) -> pa.Table:
+    """Fill the media_id column from the URLs, null where a URL has no media ID"""
+    ids = media_ids(table.column('url'))
+    return table.set_column(table.schema.get_field_index('media_id'), 'media_id', pa.array(ids, mask=ids < 0))
+
+def sort_by_media_id(source: Path, parquet_file: Path, logger: logging.Logger, csv_file: Optional[Path] = None,
+                     row_group_size: int = LOOKUP_ROW_GROUP_SIZE, memory_rows: int = SORT_MEMORY_ROWS,
+                     keep: Optional[Callable[[pa.Table, ds.Expression], pa.Table]] = None) -> int:
+    """Rewrite source sorted by media_id for point lookups; returns the number of row groups
+
+    The output has small row groups, column statistics, a page index and
+    media_id declared as its sorting column, so a reader can find the one
+    row group holding a media ID from the footer alone. At most memory_rows
+    rows are held at once: larger inputs are sorted one media ID range per
+    pass, with rows lacking a media ID written last. `keep`, if given, is
+    called with each range and its filter and returns the rows to write.
+    Scratch columns (named with a leading underscore) are not written.
+    """
+    dataset = ds.dataset(source, format='parquet')
+    schema = pa.schema([field for field in dataset.schema if not field.name.startswith('_')])
+    if dataset.count_rows() == 0:
+        pq.write_table(schema.empty_table(), parquet_file, compression='zstd')
+        if csv_file is not None:
+            pa_csv.write_csv(plain_schema(schema).empty_table(), csv_file)
+        return 0
+    # np.sort copies: a single-chunk column converts to a read-only view
+    ids = np.sort(pc.drop_null(dataset.to_table(columns=['media_id']).column('media_id')).to_numpy())
+    passes = max(1, -(-len(ids) // memory_rows))
+    cuts = np.unique(ids[[len(ids) * k // passes for k in range(1, passes)]]) if len(ids) else []
+    bounds = [None, *cuts.tolist(), None] if len(cuts) else [None, None]
+    media_id = ds.field('media_id')
+
+    filters = []
+    for lo, hi in zip(bounds, bounds[1:]):
+        condition = media_id.is_valid()
+        if lo is not None:
+            condition = condition & (media_id >= lo)
+        if hi is not None:
+            condition = condition & (media_id < hi)
+        filters.append(condition)
+    filters.append(media_id.is_null())
+
+    writer = pq.ParquetWriter(
+        parquet_file, schema, compression='zstd', write_statistics=True, write_page_index=True,
+        sorting_columns=[pq.SortingColumn(schema.get_field_index('media_id'))])
+    csv_writer = pa_csv.CSVWriter(csv_file, plain_schema(schema)) if csv_file is not None else None
+    try:
+        for condition in filters:
+            table = dataset.to_table(filter=condition)
+            if keep is not None:
+                table = keep(table, condition)
+            if table.num_rows == 0:
+                continue
+            table = table.sort_by('media_id').select(schema.names)
+            writer.write_table(table, row_group_size=row_group_size)
+            if csv_writer is not None:
+                csv_writer.write_table(table.cast(plain_schema(schema)))
+    finally:
+        writer.close()
+        if csv_writer is not None:
+            csv_writer.close()
+    row_groups = pq.ParquetFile(parquet_file).metadata.num_row_groups
+    logger.info(f"Sorted {parquet_file} by media_id in {len(filters) - 1} pass(es), {row_groups} row groups")
+    return row_groups
+
+def aggregate(sources: List[Source], output_dir: Path, logger: logging.Logger, write_csv: bool = False,
+              batch_size: int = 10000, existing: Optional[List[Path]] = None,
+              name: str = 'morphosource_data_combined', row_group_size: int = LOOKUP_ROW_GROUP_SIZE) -> Dict:
+    """Combine every source into one parquet file sorted by media ID, keeping the first record of each URL
+
+    Records are streamed to a scratch file tagged with their read order, then
+    rewritten one media ID range at a time by sort_by_media_id. A URL has a
+    single media ID, so every copy of it lands in the same range and is
+    deduplicated there in Arrow; URLs already in the `existing` parquet files
+    are dropped the same way, without holding every URL in memory.
+    """
+    schema = with_media_id(unify_schemas([source_schema(source) for source in sources]))
+    parquet_file = output_dir / f'{name}.parquet'
+    csv_file = output_dir / f'{name}.csv'
+    unsorted_file = output_dir / f'{name}.unsorted.parquet'
+
+    starts = []
+    rows_read = 0
+    writer = pq.ParquetWriter(unsorted_file, schema.append(pa.field(SEQ_COLUMN, pa.int64())), compression='zstd')
+    try:
+        for file, constants in sources:
+            starts.append(rows_read)
+            for batch in pq.ParquetFile(file).iter_batches(batch_size=batch_size):
+                table = add_media_id(conform(pa.Table.from_batches([batch]), schema, constants))
+                seq = pa.array(np.arange(rows_read, rows_read + table.num_rows, dtype=np.int64))
+                writer.write_table(table.append_column(SEQ_COLUMN, seq))
+                rows_read += table.num_rows
+    finally:
+        writer.close()
+
+    stats = ColumnStats()
+    kept = np.zeros(len(sources), dtype=np.int64)
+    merged = ds.dataset(existing, format='parquet') if existing else None
+
+    def keep_first(table: pa.Table, condition: ds.Expression) -> pa.Table:
+        firsts = table.group_by('url').aggregate([(SEQ_COLUMN, 'min')]).column(f'{SEQ_COLUMN}_min')
+        table = table.filter(pc.is_in(table.column(SEQ_COLUMN), value_set=firsts))
+        if merged is not None:
+            merged_urls = merged.to_table(columns=['url'], filter=condition).column('url').combine_chunks()
+            if len(merged_urls):
+                table = table.filter(pc.invert(pc.is_in(table.column('url'), value_set=merged_urls)))
+        origin = np.searchsorted(starts, table.column(SEQ_COLUMN).to_numpy(), side='right') - 1
+        kept[:] += np.bincount(origin, minlength=len(sources))
+        stats.add(table)
+        return table
+
+    try:
+        row_groups = sort_by_media_id(unsorted_file, parquet_file, logger, csv_file if write_csv else None,
+                                      row_group_size, keep=keep_first)
+    finally:
+        unsorted_file.unlink()
+
+    file_stats = []
+    for (file, _), records in zip(sources, kept.tolist()):
+        file_stats.append({
+            'file': str(file),
+            'records': records,
+            'size': file.stat().st_size
+        })
+        logger.info(f"Read {records} new records from {file}")
+
+    duplicates = rows_read - stats.records
+    logger.info(f"Total records in combined dataset: {stats.records} ({duplicates} duplicates dropped)")
+    return {
+        'total_records': stats.records,
+        'files_combined': len(sources),
+        'duplicates_dropped': duplicates,
+        **stats.as_dict(),
+        'row_groups': row_groups,
+        'source_files': file_stats,
+        'parquet_file': str(parquet_file),
+        'csv_file': str(csv_file) if write_csv else None
+    }
+
+def load_state(output_dir: Path) -> Dict:
+    """Runs already merged into an incremental output directory"""
+    state_file = output_dir / STATE_FILE
+    if not state_file.exists():
+        return {'runs': [], 'files': {}, 'parts': []}
+    with open(state_file) as f:
+        state = json.load(f)
+    # State files written before plain files were tracked
+    state.setdefault('files', {})
+    return state
+
+def save_state(output_dir: Path, state: Dict) -> None:
+    state_file = output_dir / STATE_FILE
+    tmp_file = state_file.with_suffix('.json.tmp')
+    with open(tmp_file, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_file, state_file)
+
+def dataset_statistics(files: List[Path]) -> Dict:
+    """Record count, processing time and media type totals over files, reading only those columns"""
+    stats = ColumnStats()
+    for file in files:
+        names = pq.read_schema(file).names
+        stats.add(pq.read_table(file, columns=[c for c in ('processing_time', 'media_type') if c in names]))
+    return {'records': stats.records, 'files': len(files), **stats.as_dict()}
+
+def aggregate_incremental(input_dir: Path, output_dir: Path, logger: logging.Logger,
+                          write_csv: bool = False, row_group_size: int = LOOKUP_ROW_GROUP_SIZE) -> Optional[Dict]:
+    """Merge only runs and plain files not merged before into a new part under output_dir/parts
+
+    URLs already in earlier parts are dropped, so every record appears in
+    exactly one part. Returns None when there is nothing new to merge.
+    """
+    state = load_state(output_dir)
+    sources, run_ids, plain_files = find_sources(input_dir, logger, set(state['runs']), state['files'])
+    # The output may live under the input directory; never merge it into itself
+    output_root = output_dir.resolve()
+    sources = [source for source in sources if output_root not in source[0].resolve().parents]
+    plain_files = {key: value for key, value in plain_files.items()
+                   if output_root not in (input_dir / key).resolve().parents}
+    if not sources:
+        return None
+    parts_dir = output_dir / PARTS_DIR
+    parts_dir.mkdir(parents=True, exist_ok=True)
+    existing = [parts_dir / part for part in state['parts']]
+    existing_rows = sum(pq.ParquetFile(part).metadata.num_rows for part in existing)
+    logger.info(f"Merging {len(run_ids)} new run(s) and {len(plain_files)} new or changed file(s) into "
+                f"{len(existing)} existing part(s) holding {existing_rows} records")
+
+    name = f"part-{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    stats = aggregate(sources, parts_dir, logger, write_csv, existing=existing, name=name,
+                      row_group_size=row_group_size)
+    parts = state['parts']
+    if stats['total_records']:
+        parts = parts + [f'{name}.parquet']
+    else:
+        Path(stats['parquet_file']).unlink()
+    save_state(output_dir, {'runs': state['runs'] + run_ids, 'files': {**state['files'], **plain_files},
+                            'parts': parts})
+    stats['runs_merged'] = run_ids
+    stats['files_merged'] = list(plain_files)
+    stats['dataset'] = dataset_statistics([parts_dir / part for part in parts])
+    return stats
+
+def write_summary(stats: Dict, stats_file: Path, summary_file: Path) -> None:
+    """Write the markdown aggregation summary"""
+    parquet_file = stats['parquet_file']
+    csv_file = stats['csv_file']
+    with open(summary_file, 'w') as f:
+        f.write("# Aggregation Summary\n\n")
+        f.write(f"- Total records: {stats['total_records']:,}\n")
+        if 'dataset' in stats:
+            f.write(f"- Runs merged: {len(stats['runs_merged'])}\n")
+            f.write(f"- Plain files merged: {len(stats['files_merged'])}\n")
+            f.write(f"- Records in dataset: {stats['dataset']['records']:,} in {stats['dataset']['files']} part(s)\n")
+        f.write(f"- Files combined: {stats['files_combined']}\n")
+        f.write(f"- Duplicates dropped: {stats['duplicates_dropped']:,}\n")
+        f.write(f"- Average processing time: {stats['avg_processing_time']:.2f}s\n")
+        f.write(f"- Total processing time: {stats['total_processing_time']:.2f}s\n")
+
+        f.write("\n## Output Files\n")
+        f.write(f"- Parquet: {os.path.basename(parquet_file)} ({os.path.getsize(parquet_file):,} bytes)\n")
+        if csv_file:
+            f.write(f"- CSV: {os.path.basename(csv_file)} ({os.path.getsize(csv_file):,} bytes)\n")
+        f.write(f"- Statistics: {stats_file.name}\n")
+
+        f.write("\n## Source Files\n")
+        for stat in stats['source_files']:
+            f.write(f"- {stat['file']}: {stat['records']:,} records ({stat['size']:,} bytes)\n")
+
+        f.write("\n## Media Types\n")
+        for media_type, count in stats.get('dataset', stats)['media_types'].items():
+            f.write(f"- {media_type}: {count:,}\n")
+
+def main():
+    parser = argparse.ArgumentParser(description='Combine processor parquet outputs into one dataset')
+    parser.add_argument('--input-dir', required=True, help='Directory containing downloaded artifacts')
+    parser.add_argument('--output-dir', required=True, help='Directory for the combined dataset')
+    parser.add_argument('--csv', action='store_true', help='Also stream a CSV copy of the combined data')
+    parser.add_argument('--summary-file', help='Markdown summary to write')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Keep the output directory across runs and add one part holding only the records '
+                             'of runs not merged before')
+    parser.add_argument('--row-group-size', type=int, default=LOOKUP_ROW_GROUP_SIZE,
+                        help='Rows per row group of the media-ID-sorted output; smaller means cheaper lookups')
+    parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    args = parser.parse_args()
+
+    logger = setup_logging(level=logging.DEBUG if args.debug else logging.INFO)
+
+    input_dir = Path(args.input_dir)
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    extract_artifacts(input_dir, logger)
+    if args.incremental:
+        stats = aggregate_incremental(input_dir, output_dir, logger, write_csv=args.csv,
+                                      row_group_size=args.row_group_size)
+        if stats is None:
+            logger.info("No new runs or files to merge")
+            return 0
+    else:
+        sources, _, _ = find_sources(input_dir, logger)
+        if not sources:
+            logger.error("No parquet files found!")
+            return 1
+        logger.info(f"Combining {len(sources)} parquet files")
+        stats = aggregate(sources, output_dir, logger, write_csv=args.csv, row_group_size=args.row_group_size)
+
+    stats_file = output_dir / 'statistics.json'
+    with open(stats_file, 'w') as f:
+        json.dump(stats, f, indent=2)
+    logger.info(f"Saved statistics to {stats_file}")
+
+    if args.summary_file:
+        write_summary(stats, stats_file, Path(args.summary_file))
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,340 @@
+import asyncio
+import logging
+import time
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from http_engine import REQUEST_HEADERS, conditional_headers, response_validators
+from instrumentation import metrics, stage_column
+from page_parser import parse_page
+from retry_policy import PERMANENT, backoff_delay, classify_error
+
+# Statuses that mean "slow down" rather than "this page is broken"
+THROTTLE_STATUSES = {429, 502, 503, 504}
+
+
+class TokenBucket:
+    """Token bucket allowing `rate` requests per second with bursts of `burst`"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def penalize(self, seconds):
+        """Drain the bucket so nothing is sent for `seconds` (e.g. after Retry-After)"""
+        self.tokens = min(self.tokens, -seconds * self.rate)
+
+
+class HostRateLimiter:
+    """One token bucket per host"""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.buckets = {}
+
+    def bucket(self, url):
+        host = urlsplit(url).netloc
+        if host not in self.buckets:
+            self.buckets[host] = TokenBucket(self.rate, self.burst)
+        return self.buckets[host]
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on in-flight requests.
+
+    The limit grows by one per window of successful requests under the target
+    latency and is cut multiplicatively on throttling, errors or slow
+    responses, at most once per cooldown so a burst of failures counts once.
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=32, target_latency=2.0, decrease=0.5, cooldown=1.0):
+        self.limit = float(max(minimum, min(initial, maximum)))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency = target_latency
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.decreases = 0
+        self._last_decrease = 0.0
+        self._cond = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._cond:
+            await self._cond.wait_for(lambda: self.in_flight < int(self.limit))
+            self.in_flight += 1
+
+    async def release(self, latency, ok):
+        async with self._cond:
+            self.in_flight -= 1
+            now = time.monotonic()
+            if not ok or latency > self.target_latency:
+                if now - self._last_decrease >= self.cooldown:
+                    self.limit = max(self.minimum, self.limit * self.decrease)
+                    self._last_decrease = now
+                    self.decreases += 1
+            else:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+
+async def fetch_with_retries(session, url, limiter, concurrency, logger, retry_count=2, timeout=10,
+                             retry_base_delay=1.0, retry_max_delay=30.0, validators=None, prior=None):
+    """Fetch a page, backing off on throttling and transient errors
+
+    With validators from an earlier fetch the request is conditional, and a
+    304 comes back as a not_modified result without HTML. `prior` is an
+    earlier fetch result of the same URL whose attempts count towards
+    retry_count, for pages fetched again after failing to parse.
+    """
+    attempts = prior['attempts'] if prior else 0
+    errors = prior['errors'] if prior else 0
+    start_time = prior['start_time'] if prior else time.time()
+    reason = 'max_attempts'
+    error = None
+    
+    while attempts < retry_count:
+        attempts += 1
+        bucket = limiter.bucket(url)
+        await bucket.acquire()
+        await concurrency.acquire()
+        request_start = time.monotonic()
+        ok = False
+        retry_after = None
+        try:
+            async with session.get(url, headers=conditional_headers(validators),
+                                   timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+                if response.status == 304:
+                    ok = True
+                    navigation_time = time.monotonic() - request_start
+                    metrics.observe('navigation', navigation_time)
+                    return {'url': url, 'html': None, 'not_modified': True, 'errors': errors, 'attempts': attempts,
+                            'start_time': start_time, 'navigation_time': navigation_time,
+                            'validators': response_validators(response.headers)}
+                if response.status in THROTTLE_STATUSES:
+                    retry_after = response.headers.get('Retry-After')
+                    raise aiohttp.ClientResponseError(
+                        response.request_info, response.history,
+                        status=response.status, message=response.reason)
+                response.raise_for_status()
+                page_html = await response.text()
+                page_validators = response_validators(response.headers)
+            ok = True
+            navigation_time = time.monotonic() - request_start
+            metrics.observe('navigation', navigation_time)
+            return {'url': url, 'html': page_html, 'errors': errors, 'attempts': attempts, 'start_time': start_time,
+                    'navigation_time': navigation_time, 'validators': page_validators}
+        except asyncio.TimeoutError as e:
+            logger.warning(f"Timeout on attempt {attempts} for {url}")
+            reason = 'timeout'
+            error = e
+        except aiohttp.ClientResponseError as e:
+            logger.warning(f"HTTP {e.status} on attempt {attempts} for {url}")
+            reason = 'max_attempts'
+            error = e
+            if e.status not in THROTTLE_STATUSES:
+                # A broken page says nothing about server load
+                ok = True
+            if classify_error(e) == PERMANENT:
+                reason = 'permanent'
+                errors += 1
+                break
+        except aiohttp.ClientError as e:
+            logger.warning(f"Error on attempt {attempts} for {url}: {e}")
+            reason = 'max_attempts'
+            error = e
+        except Exception as e:
+            # e.g. a body in an unknown encoding; fail this URL rather than the whole crawl
+            logger.warning(f"Error on attempt {attempts} for {url}: {e!r}")
+            reason = 'max_attempts'
+            error = e
+            ok = True
+            if classify_error(e) == PERMANENT:
+                reason = 'permanent'
+                errors += 1
+                break
+        finally:
+            await concurrency.release(time.monotonic() - request_start, ok)
+        
+        errors += 1
+        delay = backoff_delay(attempts, retry_base_delay, retry_max_delay)
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, float(retry_after))
+            bucket.penalize(float(retry_after))
+        if attempts < retry_count:
+            metrics.count('retries')
+            await asyncio.sleep(delay)
+    
+    return {'url': url, 'html': None, 'errors': errors, 'attempts': attempts,
+            'reason': reason, 'error': error, 'start_time': start_time}
+
+
+async def crawl(urls, on_outcome, logger=None, concurrency=4, max_concurrency=32,
+                rate_limit=5.0, burst=5, retry_count=2, timeout=10, retry_base_delay=1.0, retry_max_delay=30.0,
+                validators_for=None, stop=None, window=None):
+    """Crawl `urls` with a producer, adaptive fetchers and an in-order parse consumer.
+
+    `on_outcome` receives one outcome per URL in input order, in the same
+    shape process_url returns. At most `window` URLs (default twice
+    max_concurrency) are past the producer and not yet handed to on_outcome,
+    so one slow URL cannot make the pages fetched after it pile up.
+    `validators_for(url)` may return the ETag and Last-Modified a URL was last
+    served with, to revalidate it conditionally. Once `stop()` returns true
+    no more URLs are queued and the remaining outcomes are dropped instead of
+    passed to on_outcome.
+
+    Pages that fail to parse with a retryable error are fetched again after
+    the main pass, as the sync engine's RetryScheduler does, until
+    retry_count attempts are used up; their outcomes come last.
+    """
+    logger = logger or logging.getLogger(__name__)
+    limiter = HostRateLimiter(rate_limit, burst)
+    adaptive = AdaptiveConcurrency(initial=concurrency, maximum=max_concurrency)
+    window = window or max_concurrency * 2
+    ahead = asyncio.Semaphore(window)
+    url_queue = asyncio.Queue(maxsize=max_concurrency * 2)
+    page_queue = asyncio.Queue(maxsize=window)
+    deferred = []
+    loop = asyncio.get_running_loop()
+    
+    def stopped():
+        return stop is not None and stop()
+    
+    async def produce():
+        for seq, url in enumerate(urls):
+            if stopped():
+                break
+            await ahead.acquire()
+            await url_queue.put((seq, url))
+        for _ in range(max_concurrency):
+            await url_queue.put(None)
+    
+    async def fetch(session):
+        while True:
+            item = await url_queue.get()
+            if item is None:
+                return
+            seq, url = item
+            validators = validators_for(url) if validators_for is not None else None
+            await page_queue.put((seq, await fetch_with_retries(
+                session, url, limiter, adaptive, logger, retry_count, timeout,
+                retry_base_delay, retry_max_delay, validators)))
+    
+    async def consume():
+        # Pages arrive out of order; hold them until their turn comes up
+        waiting = {}
+        next_seq = 0
+        while True:
+            item = await page_queue.get()
+            if item is None:
+                return
+            seq, fetched = item
+            waiting[seq] = fetched
+            while next_seq in waiting:
+                fetched = waiting.pop(next_seq)
+                next_seq += 1
+                try:
+                    await emit(fetched)
+                finally:
+                    ahead.release()
+    
+    async def emit(fetched):
+        if stopped():
+            return
+        outcome = await parse_outcome(fetched)
+        if outcome['reason'] == 'retry':
+            metrics.count('retries')
+            logger.info(f"Deferred {outcome['url']} for retry after attempt {outcome['attempts']}")
+            deferred.append(dict(fetched, errors=outcome['errors']))
+            return
+        try:
+            on_outcome(outcome)
+        except Exception as e:
+            # A bad record must not stop the consumer, or the fetchers block on a full queue
+            logger.error(f"Error handling outcome for {outcome['url']}: {e}", exc_info=True)
+    
+    async def refetch(session, fetched):
+        await asyncio.sleep(backoff_delay(fetched['attempts'], retry_base_delay, retry_max_delay))
+        url = fetched['url']
+        validators = validators_for(url) if validators_for is not None else None
+        return await fetch_with_retries(session, url, limiter, adaptive, logger, retry_count, timeout,
+                                        retry_base_delay, retry_max_delay, validators, prior=fetched)
+    
+    def parse_failed(outcome, fetched, error):
+        outcome['errors'] += 1
+        outcome['error'] = error
+        if classify_error(error) == PERMANENT:
+            outcome['reason'] = 'permanent'
+        elif fetched['attempts'] < retry_count:
+            outcome['reason'] = 'retry'
+        else:
+            outcome['reason'] = 'max_attempts'
+    
+    def parse_timed(page_html, url):
+        # Runs on an executor thread, so the per-record stage times are its own
+        metrics.begin_record()
+        try:
+            page_data = parse_page(page_html, url, logger)
+        finally:
+            stages = metrics.end_record()
+        page_data.update(stages)
+        return page_data
+    
+    async def parse_outcome(fetched):
+        outcome = {'url': fetched['url'], 'data': None, 'errors': fetched['errors'],
+                   'attempts': fetched['attempts'], 'reason': fetched.get('reason'),
+                   'error': fetched.get('error'), 'unchanged': fetched.get('not_modified', False),
+                   'validators': fetched.get('validators')}
+        if fetched['html'] is not None:
+            try:
+                page_data = await loop.run_in_executor(None, parse_timed, fetched['html'], fetched['url'])
+            except Exception as e:
+                # e.g. an empty document; fail the URL like the sync engine's parse stage does
+                logger.error(f"Error parsing {fetched['url']}: {str(e)}")
+                parse_failed(outcome, fetched, e)
+                outcome['processing_time'] = time.time() - fetched['start_time']
+                return outcome
+            if metrics.enabled:
+                page_data[stage_column('navigation')] = fetched['navigation_time']
+            page_data['attempt'] = fetched['attempts']
+            page_data['processing_time'] = time.time() - fetched['start_time']
+            if page_data.get('error'):
+                logger.warning(f"Data extracted with error: {page_data['error']}")
+                parse_failed(outcome, fetched, page_data['error'])
+            else:
+                outcome['data'] = page_data
+        outcome['processing_time'] = time.time() - fetched['start_time']
+        return outcome
+    
+    connector = aiohttp.TCPConnector(limit=max_concurrency, limit_per_host=max_concurrency)
+    async with aiohttp.ClientSession(headers=REQUEST_HEADERS, connector=connector) as session:
+        consumer = asyncio.create_task(consume())
+        await asyncio.gather(produce(), *(fetch(session) for _ in range(max_concurrency)))
+        await page_queue.put(None)
+        await consumer
+        
+        # Drain the deferred retries once the main pass is done
+        while deferred and not stopped():
+            retry, deferred[:] = list(deferred), []
+            logger.info(f"Retrying {len(retry)} deferred URL(s)")
+            for fetched in await asyncio.gather(*(refetch(session, fetched) for fetched in retry)):
+                await emit(fetched)
+    
+    logger.info(f"Crawl finished with concurrency limit {adaptive.limit:.1f} "
+                f"after {adaptive.decreases} decrease(s)")
@@ -0,0 +1,121 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+import multiprocessing
+from collections import Counter
+from pathlib import Path
+
+from shard_queue import LeaseKeeper, LeaseLost, SQLiteShardQueue
+
+def setup_logging(level=logging.INFO):
+    """Configure logging for the script"""
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(processName)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def run_worker(queue_file, results_file, owner, lease_seconds, seconds_per_url, crash_after):
+    """Claim shards until the queue drains, like run_queue, appending each completed shard's indices
+
+    With crash_after set, the process exits without releasing its shard once it
+    has handled that many URLs, so the shard has to come back through lease expiry.
+    """
+    logger = setup_logging()
+    shards = SQLiteShardQueue(queue_file, lease_seconds, max_claims=3, logger=logger)
+    handled = 0
+    try:
+        while True:
+            shard = shards.claim(owner)
+            if shard is None:
+                if not shards.counts().get('leased'):
+                    return
+                time.sleep(lease_seconds / 3)
+                continue
+            indices = []
+            with LeaseKeeper(shards, shard, owner, lease_seconds / 3, logger) as lease:
+                try:
+                    for index in range(shard.start, shard.end):
+                        lease.check()
+                        time.sleep(seconds_per_url)
+                        indices.append(index)
+                        handled += 1
+                        if crash_after is not None and handled >= crash_after:
+                            logger.info(f"{owner} crashing in shard {shard.id}")
+                            os._exit(1)
+                except LeaseLost:
+                    continue
+            if not lease.lost and shards.complete(shard, owner):
+                with open(results_file, 'a') as f:
+                    f.write(json.dumps({'owner': owner, 'shard': shard.id, 'indices': indices}) + '\n')
+    finally:
+        shards.close()
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run several worker processes against one shard queue and check every URL index is '
+                    'completed exactly once')
+    parser.add_argument('--workers', type=int, default=3)
+    parser.add_argument('--urls', type=int, default=600, help='URL indices to seed the queue with')
+    parser.add_argument('--chunk-size', type=int, default=25)
+    parser.add_argument('--lease-seconds', type=float, default=1.0)
+    parser.add_argument('--seconds-per-url', type=float, default=0.002, help='Simulated work per URL')
+    parser.add_argument('--crash', action='store_true',
+                        help='Make the first worker die mid-shard, so its shard is reclaimed after the lease expires')
+    args = parser.parse_args()
+
+    logger = setup_logging()
+    with tempfile.TemporaryDirectory() as tmp:
+        queue_file = Path(tmp) / 'queue.sqlite'
+        results_file = Path(tmp) / 'completed.jsonl'
+        shards = SQLiteShardQueue(queue_file, args.lease_seconds, logger=logger)
+        shards.seed(0, args.urls, args.chunk_size)
+
+        context = multiprocessing.get_context('spawn')
+        processes = []
+        for n in range(args.workers):
+            crash_after = args.chunk_size // 2 if args.crash and n == 0 else None
+            processes.append(context.Process(
+                target=run_worker, name=f'worker-{n}',
+                args=(queue_file, results_file, f'worker-{n}', args.lease_seconds, args.seconds_per_url,
+                      crash_after)))
+        start = time.perf_counter()
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join()
+        elapsed = time.perf_counter() - start
+
+        counts = shards.counts()
+        shards.close()
+        completed = [json.loads(line) for line in results_file.read_text().splitlines()] \
+            if results_file.exists() else []
+
+    seen = Counter(index for shard in completed for index in shard['indices'])
+    repeated = sorted(index for index, n in seen.items() if n > 1)
+    missing = sorted(set(range(args.urls)) - set(seen))
+    per_worker = Counter(shard['owner'] for shard in completed)
+    logger.info(f"{len(completed)} shard(s) completed in {elapsed:.1f} s by {dict(sorted(per_worker.items()))}; "
+                f"queue state: {counts}")
+    failures = []
+    if repeated:
+        failures.append(f"{len(repeated)} index(es) completed more than once, e.g. {repeated[:5]}")
+    if missing:
+        failures.append(f"{len(missing)} index(es) never completed, e.g. {missing[:5]}")
+    if counts != {'done': len(completed)}:
+        failures.append(f"queue not fully done: {counts}")
+    for failure in failures:
+        logger.error(failure)
+    if not failures:
+        logger.info(f"Every one of {args.urls} indices was completed exactly once")
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
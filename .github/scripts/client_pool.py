@@ -0,0 +1,88 @@
+import logging
+import queue
+import threading
+
+from instrumentation import metrics
+
+
+class ClientPool:
+    """Fixed-size pool of reusable page clients (Chrome drivers or HTTP sessions).
+
+    Clients are created lazily up to `size` and handed back to the idle queue
+    after each page, so every worker keeps a warm client between records.
+    A client is only recycled after `error_threshold` consecutive failures,
+    or straight away when the failure is fatal to it.
+    """
+
+    def __init__(self, factory, closer, size=1, logger=None, error_threshold=3):
+        self.factory = factory
+        self.closer = closer
+        self.size = max(1, size)
+        self.logger = logger or logging.getLogger(__name__)
+        self.error_threshold = max(1, error_threshold)
+        self.created = 0
+        self.recycled = 0
+        self.recycle_reasons = {}
+        self._failures = {}
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Take an idle client, creating one if the pool is not yet full"""
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            return self._new_client()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def _new_client(self):
+        client = self.factory()
+        with self._lock:
+            self._clients.add(client)
+            self.created += 1
+        metrics.count('clients_created')
+        return client
+
+    def release(self, client, failed=False, fatal=False):
+        """Return a client to the pool, recycling it once it has failed too often"""
+        if failed:
+            failures = self._failures.get(id(client), 0) + 1
+            if fatal or failures >= self.error_threshold:
+                self.logger.info(f"Recycling client after {failures} consecutive failure(s)")
+                self._recycle(client, 'errors')
+                return
+            self._failures[id(client)] = failures
+        else:
+            self._failures.pop(id(client), None)
+        self._idle.put(client)
+        self._slots.release()
+
+    def _recycle(self, client, reason):
+        with self._lock:
+            self.recycled += 1
+            self.recycle_reasons[reason] = self.recycle_reasons.get(reason, 0) + 1
+        metrics.count('client_restarts')
+        self.discard(client)
+
+    def discard(self, client):
+        """Close a failed client and free its slot"""
+        if client is not None:
+            with self._lock:
+                self._clients.discard(client)
+                self._failures.pop(id(client), None)
+            self.closer(client)
+        self._slots.release()
+
+    def close(self):
+        """Close every client the pool created, idle or not"""
+        with self._lock:
+            clients, self._clients = self._clients, set()
+        for client in clients:
+            self.closer(client)
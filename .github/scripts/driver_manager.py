@@ -0,0 +1,167 @@
+import queue
+import threading
+import time
+
+from client_pool import ClientPool
+from instrumentation import metrics
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+# Pages between RSS probes; walking the Chrome process tree costs a few ms
+RSS_CHECK_INTERVAL = 10
+
+def process_tree_rss_mb(pid):
+    """Resident memory of a process and all its children in MB, or None without psutil"""
+    if psutil is None or pid is None:
+        return None
+    try:
+        process = psutil.Process(pid)
+        processes = [process] + process.children(recursive=True)
+    except psutil.Error:
+        return None
+    total = 0
+    for proc in processes:
+        try:
+            total += proc.memory_info().rss
+        except psutil.Error:
+            continue
+    return total / (1024 * 1024)
+
+
+class DriverManager(ClientPool):
+    """ClientPool for Chrome drivers with warm spares, health checks and proactive recycling.
+
+    A background thread keeps `warm` started drivers in reserve, so replacing
+    a recycled driver is a queue get rather than a Chrome cold start, and
+    retired drivers are quit on that thread too. With warm=0 no thread is
+    started and retired drivers are quit inline. A driver is retired after
+    `max_pages` pages, once `rss_probe` reports more than `max_rss_mb`, or
+    when `health_check` fails before it is handed out again.
+    """
+
+    def __init__(self, factory, closer, size=1, logger=None, error_threshold=3, warm=1,
+                 max_pages=0, max_rss_mb=0, health_check=None, rss_probe=None):
+        super().__init__(factory, closer, size, logger, error_threshold)
+        self.warm = max(0, warm)
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.health_check = health_check
+        self.rss_probe = rss_probe
+        self.start_times = []
+        self._pages = {}
+        self._spares = queue.Queue()
+        self._retiring = queue.Queue()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        if self.max_rss_mb and rss_probe is not None and psutil is None:
+            self.logger.warning("psutil is not installed; drivers will not be recycled on memory use")
+        self._thread = None
+        if self.warm:
+            self._thread = threading.Thread(target=self._maintain, name='driver-manager', daemon=True)
+            self._thread.start()
+
+    def _start_driver(self):
+        start = time.perf_counter()
+        client = self.factory()
+        elapsed = time.perf_counter() - start
+        with self._lock:
+            self._clients.add(client)
+            self.created += 1
+            self.start_times.append(elapsed)
+        metrics.count('clients_created')
+        metrics.observe('client_start', elapsed)
+        return client
+
+    def _new_client(self):
+        try:
+            client = self._spares.get_nowait()
+        except queue.Empty:
+            return self._start_driver()
+        self._wake.set()
+        return client
+
+    def _maintain(self):
+        # Quit retired drivers and top up the spares until close()
+        while not self._stopped.is_set():
+            self._quit_retired()
+            if self._spares.qsize() < self.warm:
+                try:
+                    self._spares.put(self._start_driver())
+                except Exception as e:
+                    self.logger.warning(f"Could not pre-warm a driver: {e}")
+                    self._stopped.wait(5)
+                continue
+            self._wake.wait(1)
+            self._wake.clear()
+
+    def _quit_retired(self):
+        while True:
+            try:
+                client = self._retiring.get_nowait()
+            except queue.Empty:
+                return
+            self.closer(client)
+
+    def acquire(self):
+        """Hand out a driver, replacing any that fails its health check"""
+        while True:
+            client = super().acquire()
+            if self.health_check is None or not self._pages.get(id(client)) or self.health_check(client):
+                return client
+            self.logger.info("Recycling driver that failed its health check")
+            self._recycle(client, 'health')
+
+    def release(self, client, failed=False, fatal=False):
+        """Return a driver, retiring it once it has served max_pages or grown past max_rss_mb"""
+        pages = self._pages.get(id(client), 0) + 1
+        self._pages[id(client)] = pages
+        if not failed:
+            if self.max_pages and pages >= self.max_pages:
+                self.logger.info(f"Recycling driver after {pages} pages")
+                self._recycle(client, 'pages')
+                return
+            if self.max_rss_mb and self.rss_probe is not None and pages % RSS_CHECK_INTERVAL == 0:
+                rss = self.rss_probe(client)
+                if rss is not None and rss > self.max_rss_mb:
+                    self.logger.info(f"Recycling driver using {rss:.0f} MB after {pages} pages")
+                    self._recycle(client, 'rss')
+                    return
+        super().release(client, failed, fatal)
+
+    def discard(self, client):
+        """Retire a driver in the background and free its slot"""
+        if self._thread is None:
+            if client is not None:
+                self._pages.pop(id(client), None)
+            super().discard(client)
+            return
+        if client is not None:
+            with self._lock:
+                self._clients.discard(client)
+                self._failures.pop(id(client), None)
+            self._pages.pop(id(client), None)
+            self._retiring.put(client)
+            self._wake.set()
+        self._slots.release()
+
+    def close(self):
+        """Stop the background thread and quit every driver, spare or not"""
+        self._stopped.set()
+        if self._thread is not None:
+            self._wake.set()
+            self._thread.join()
+        self._quit_retired()
+        while True:
+            try:
+                self._spares.get_nowait()
+            except queue.Empty:
+                break
+        super().close()
+        if self.start_times:
+            self.logger.info(
+                f"Started {len(self.start_times)} driver(s) in {sum(self.start_times) / len(self.start_times):.2f}s "
+                f"on average (max {max(self.start_times):.2f}s); recycled {self.recycled} "
+                f"({', '.join(f'{k}: {v}' for k, v in sorted(self.recycle_reasons.items())) or 'none'})")
@@ -1,12 +1,18 @@
 import os
 import glob
-import pandas as pd
 import argparse
 import logging
 from pathlib import Path
-from typing import Tuple, List, Optional
+from typing import Dict, Tuple, List, Optional
+from concurrent.futures import ThreadPoolExecutor
 import sys
 import traceback
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# Only these columns are read to compute the test statistics
+STATS_COLUMNS = ['processing_time', 'error']
 
 def setup_logging(level: int = logging.INFO) -> logging.Logger:
     """Configure logging for the script"""
@@ -20,21 +26,32 @@ def setup_logging(level: int = logging.INFO) -> logging.Logger:
     return logging.getLogger(__name__)
 
 def validate_parquet_file(file_path: Path) -> Tuple[bool, str]:
-    """Validate parquet file structure"""
+    """Validate parquet file structure from its footer alone"""
     required_columns = {'url', 'processing_time', 'error', 'batch_index'}
     try:
-        df = pd.read_parquet(file_path)
-        missing_cols = required_columns - set(df.columns)
+        schema = pq.read_schema(file_path)
+        missing_cols = required_columns - set(schema.names)
         if missing_cols:
             return False, f"Missing required columns: {missing_cols}"
         return True, "Valid parquet file"
     except Exception as e:
         return False, f"Error validating parquet file: {str(e)}"
 
-def evaluate_test_results(artifacts_dir: str, logger: logging.Logger) -> Tuple[bool, float, str]:
+def read_stats_columns(file_path: Path) -> Tuple[Optional[pa.Table], Optional[str]]:
+    """Read just the columns the statistics need"""
+    try:
+        table = pq.read_table(file_path, columns=STATS_COLUMNS)
+        index = table.schema.get_field_index('processing_time')
+        return table.set_column(index, 'processing_time', table.column('processing_time').cast(pa.float64())), None
+    except Exception as e:
+        return None, str(e)
+
+def evaluate_test_results(artifacts_dir: str, logger: logging.Logger,
+                          latency: Optional[Dict[str, float]] = None) -> Tuple[bool, float, str]:
     """
     Evaluate test results from parquet files
     Returns: (success, avg_time, message)
+    If a latency dict is given, it is filled with the median and p95 processing times.
     """
     success = False
     avg_time = 0
@@ -49,7 +66,7 @@ def evaluate_test_results(artifacts_dir: str, logger: logging.Logger) -> Tuple[b
         message.append(f"Checking directory: {artifacts_dir}")
         
         # Search recursively for parquet files
-        parquet_files = []
+        candidates = []
         for root, dirs, files in os.walk(artifacts_dir):
             logger.debug(f"Scanning {root}")
             message.append(f"Scanning {root}")
@@ -57,48 +74,59 @@ def evaluate_test_results(artifacts_dir: str, logger: logging.Logger) -> Tuple[b
             message.append(f"Found files: {files}")
             for file in files:
                 if file.endswith('.parquet'):
-                    full_path = Path(root) / file
-                    # Validate file before adding
-                    is_valid, validation_msg = validate_parquet_file(full_path)
-                    if is_valid:
-                        parquet_files.append(full_path)
-                        message.append(f"Found valid parquet file: {full_path}")
-                    else:
-                        message.append(f"Invalid parquet file {full_path}: {validation_msg}")
+                    candidates.append(Path(root) / file)
         
-        if not parquet_files:
-            message.append("No valid parquet files found")
-            return False, 0, "\n".join(message)
+        # Validate and read only the columns needed for the statistics, a file per thread
+        with ThreadPoolExecutor(max_workers=min(8, len(candidates) or 1)) as executor:
+            validations = list(executor.map(validate_parquet_file, candidates))
+            parquet_files = []
+            for full_path, (is_valid, validation_msg) in zip(candidates, validations):
+                if is_valid:
+                    parquet_files.append(full_path)
+                    message.append(f"Found valid parquet file: {full_path}")
+                else:
+                    message.append(f"Invalid parquet file {full_path}: {validation_msg}")
+            
+            if not parquet_files:
+                message.append("No valid parquet files found")
+                return False, 0, "\n".join(message)
             
-        # Process all valid parquet files
-        dfs = []
-        for file in parquet_files:
-            try:
-                df = pd.read_parquet(file)
-                dfs.append(df)
-                message.append(f"Successfully read parquet file: {file}")
-                message.append(f"DataFrame shape: {df.shape}")
-                message.append(f"Columns: {df.columns.tolist()}")
-            except Exception as e:
-                logger.error(f"Error reading {file}: {e}")
-                message.append(f"Error reading parquet file: {str(e)}")
+            reads = list(executor.map(read_stats_columns, parquet_files))
         
-        if not dfs:
+        tables = []
+        for file, (table, error) in zip(parquet_files, reads):
+            if table is None:
+                logger.error(f"Error reading {file}: {error}")
+                message.append(f"Error reading parquet file: {error}")
+                continue
+            tables.append(table)
+            message.append(f"Successfully read parquet file: {file}")
+            message.append(f"Rows: {table.num_rows}")
+        
+        if not tables:
             return False, 0, "\n".join(message)
             
-        # Combine all dataframes
-        df = pd.concat(dfs, ignore_index=True)
-        records = len(df)
-        avg_time = df.processing_time.mean()
-        errors = df['error'].notna().sum()
+        # Combine the projected columns
+        times = pa.chunked_array([t.column('processing_time') for t in tables], type=pa.float64())
+        records = len(times)
+        if records == 0:
+            message.append("No records found")
+            return False, 0, "\n".join(message)
+        avg_time = pc.mean(times).as_py() or 0.0
+        median_time, p95_time = [q or 0.0 for q in pc.quantile(times, q=[0.5, 0.95]).to_pylist()]
+        max_time = pc.max(times).as_py() or 0.0
+        if latency is not None:
+            latency.update(median_time=median_time, p95_time=p95_time)
+        errors = sum(t.num_rows - t.column('error').null_count for t in tables)
         
         # Add detailed statistics
         message.append(
             f'\nTest Results:'
             f'\nTotal records processed: {records}'
             f'\nAverage processing time: {avg_time:.2f}s'
-            f'\nMedian processing time: {df.processing_time.median():.2f}s'
-            f'\nMax processing time: {df.processing_time.max():.2f}s'
+            f'\nMedian processing time: {median_time:.2f}s'
+            f'\nP95 processing time: {p95_time:.2f}s'
+            f'\nMax processing time: {max_time:.2f}s'
             f'\nRecords with errors: {errors}'
             f'\nError rate: {(errors/records*100):.1f}%'
         )
@@ -142,7 +170,8 @@ def main():
     logger = setup_logging(level=logging.DEBUG if args.debug else logging.INFO)
     
     try:
-        success, avg_time, message = evaluate_test_results(args.artifacts_dir, logger)
+        latency: Dict[str, float] = {}
+        success, avg_time, message = evaluate_test_results(args.artifacts_dir, logger, latency)
         
         # Print results
         print(message)
@@ -152,6 +181,8 @@ def main():
             with open(args.github_output, 'a') as f:
                 f.write(f'success={str(success).lower()}\n')
                 f.write(f'avg_time={avg_time}\n')
+                f.write(f'median_time={latency.get("median_time", 0)}\n')
+                f.write(f'p95_time={latency.get("p95_time", 0)}\n')
                 
         # Exit with appropriate status code
         sys.exit(0 if success else 1)
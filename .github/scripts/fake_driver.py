@@ -0,0 +1,66 @@
+import time
+import urllib.error
+import urllib.request
+
+from lxml import html as lxml_html
+
+from page_parser import element_text
+
+
+class FakeElement:
+    def __init__(self, elem):
+        self.text = element_text(elem)
+
+
+class FakeDriver:
+    """Stand-in for a Chrome WebDriver that loads pages over plain HTTP.
+
+    Covers the calls the processor makes on a driver, so the selenium code
+    path and the DriverManager can run in benchmarks and local checks
+    without Chrome. `start_delay` mimics Chrome's cold start.
+    """
+
+    def __init__(self, start_delay=0.0, timeout=5):
+        time.sleep(start_delay)
+        self.timeout = timeout
+        self.page_source = ''
+        self.alive = True
+        self.pages = 0
+
+    def _check_session(self):
+        if not self.alive:
+            raise RuntimeError('invalid session id')
+
+    def execute_cdp_cmd(self, cmd, params):
+        self._check_session()
+        return {}
+
+    def execute_script(self, script, *args):
+        self._check_session()
+        return 1 if script.strip() == 'return 1' else None
+
+    def get(self, url):
+        self._check_session()
+        try:
+            with urllib.request.urlopen(url, timeout=self.timeout) as response:
+                self.page_source = response.read().decode('utf-8', 'replace')
+        except urllib.error.HTTPError as e:
+            # Chrome renders error responses rather than raising
+            self.page_source = e.read().decode('utf-8', 'replace')
+        self.pages += 1
+
+    @property
+    def title(self):
+        if not self.page_source:
+            return ''
+        return lxml_html.fromstring(self.page_source).findtext('.//title') or ''
+
+    def find_element(self, by, value):
+        self._check_session()
+        elems = lxml_html.fromstring(self.page_source).xpath(value) if self.page_source else []
+        if not elems:
+            raise LookupError(f'no such element: {value}')
+        return FakeElement(elems[0])
+
+    def quit(self):
+        self.alive = False
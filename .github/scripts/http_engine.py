@@ -0,0 +1,42 @@
+import requests
+from requests.adapters import HTTPAdapter
+
+REQUEST_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) Parquet-Processor',
+    'Accept': 'text/html,application/xhtml+xml',
+    'Accept-Language': 'en',
+}
+
+def create_session(pool_size=4):
+    """Create a keep-alive HTTP session with a pooled connection adapter"""
+    session = requests.Session()
+    session.headers.update(REQUEST_HEADERS)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=0)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def conditional_headers(validators):
+    """If-None-Match/If-Modified-Since headers for the validators a page was last served with"""
+    headers = {}
+    if validators and validators.get('etag'):
+        headers['If-None-Match'] = validators['etag']
+    if validators and validators.get('last_modified'):
+        headers['If-Modified-Since'] = validators['last_modified']
+    return headers
+
+def response_validators(headers):
+    """The ETag and Last-Modified a response carried"""
+    return {'etag': headers.get('ETag'), 'last_modified': headers.get('Last-Modified')}
+
+def fetch_page_conditional(session, url, validators=None, timeout=10):
+    """Fetch a media page unless it is unchanged since `validators` were recorded
+
+    Returns (html, validators), with html None when the server answered
+    304 Not Modified.
+    """
+    response = session.get(url, headers=conditional_headers(validators), timeout=timeout)
+    if response.status_code == 304:
+        return None, response_validators(response.headers)
+    response.raise_for_status()
+    return response.text, response_validators(response.headers)
@@ -0,0 +1,180 @@
+import bisect
+import contextlib
+import json
+import threading
+import time
+from pathlib import Path
+
+# Stages timed per record and written as extra parquet columns
+RECORD_STAGES = ('client', 'navigation', 'layout', 'extraction')
+# Stages that only make sense for the run as a whole
+RUN_STAGES = ('serialization', 'flush')
+
+# Histogram bucket upper bounds in seconds, Prometheus style
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_NOOP = contextlib.nullcontext()
+
+def stage_column(stage):
+    """Parquet column holding a record's time in a stage"""
+    return f'{stage}_time'
+
+
+class Histogram:
+    """Cumulative-bucket latency histogram"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating within its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / n)
+            seen += n
+        return self.max
+
+    def summary(self):
+        cumulative = 0
+        buckets = {}
+        for bound, n in zip(BUCKETS + ('+Inf',), self.counts):
+            cumulative += n
+            buckets[str(bound)] = cumulative
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'mean': self.sum / self.count if self.count else 0.0,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p95': self.quantile(0.95),
+            'buckets': buckets,
+        }
+
+
+class StageTimer:
+    def __init__(self, metrics, stage):
+        self.metrics = metrics
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.metrics.observe(self.stage, time.perf_counter() - self.start)
+
+
+class Metrics:
+    """Stage timers and event counters for a processor run.
+
+    Disabled by default: stage() then hands back a shared no-op context and
+    count()/observe() return at once, so instrumented code costs one
+    attribute check. Stage times observed between begin_record() and
+    end_record() on the same thread are also collected per record.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started = time.time()
+        self.histograms = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def enable(self):
+        self.enabled = True
+        self.started = time.time()
+
+    def stage(self, name):
+        """Context manager timing one stage"""
+        if not self.enabled:
+            return _NOOP
+        return StageTimer(self, name)
+
+    def observe(self, name, seconds):
+        """Record time spent in a stage"""
+        if not self.enabled:
+            return
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram()
+            self.histograms[name].observe(seconds)
+        stages = getattr(self._local, 'stages', None)
+        if stages is not None:
+            stages[name] = stages.get(name, 0.0) + seconds
+
+    def count(self, name, n=1):
+        """Increment an event counter"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def begin_record(self):
+        """Start collecting stage times for the record handled on this thread"""
+        if self.enabled:
+            self._local.stages = {}
+
+    def end_record(self):
+        """Stop collecting and return this thread's per-record stage columns"""
+        stages = getattr(self._local, 'stages', None)
+        self._local.stages = None
+        if stages is None:
+            return {}
+        return {stage_column(stage): stages.get(stage) for stage in RECORD_STAGES}
+
+    def summary(self):
+        with self._lock:
+            return {
+                'elapsed_seconds': time.time() - self.started,
+                'stages': {name: h.summary() for name, h in self.histograms.items()},
+                'counters': dict(self.counters),
+            }
+
+    def prometheus(self):
+        """Render the summary in the Prometheus text exposition format"""
+        summary = self.summary()
+        lines = ['# TYPE processor_stage_seconds histogram']
+        for stage, stats in summary['stages'].items():
+            for bound, count in stats['buckets'].items():
+                lines.append(f'processor_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+            lines.append(f'processor_stage_seconds_sum{{stage="{stage}"}} {stats["sum"]}')
+            lines.append(f'processor_stage_seconds_count{{stage="{stage}"}} {stats["count"]}')
+        lines.append('# TYPE processor_events_total counter')
+        for name, value in summary['counters'].items():
+            lines.append(f'processor_events_total{{event="{name}"}} {value}')
+        lines.append('# TYPE processor_elapsed_seconds gauge')
+        lines.append(f'processor_elapsed_seconds {summary["elapsed_seconds"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path):
+        """Write the run summary, as Prometheus text for a .prom path and JSON otherwise"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as f:
+            if path.suffix == '.prom':
+                f.write(self.prometheus())
+            else:
+                json.dump(self.summary(), f, indent=2)
+
+
+# Shared by every module in the processor; main() enables it
+metrics = Metrics()
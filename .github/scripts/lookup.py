@@ -0,0 +1,148 @@
+import sys
+import json
+import logging
+import argparse
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from work_catalog import media_ids
+
+# (file index, row group index)
+RowGroupRef = Tuple[int, int]
+
+def setup_logging(level: int = logging.INFO) -> logging.Logger:
+    """Configure logging for the script"""
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+
+class RecordLookup:
+    """Point lookups by media ID over aggregator outputs, reading one row group per miss.
+
+    The media_id min/max of every row group comes from the parquet footers,
+    so finding a record costs one footer read per file up front and then
+    only the column chunks of the row group that can hold it. The files
+    should be sorted by media_id (the aggregator writes them that way);
+    unsorted files still work, only with overlapping ranges to check.
+    Decoded row groups are kept in an LRU of `cache_size` entries.
+    """
+
+    def __init__(self, paths: Sequence[Path], cache_size: int = 16, columns: Optional[List[str]] = None):
+        self.files = [pq.ParquetFile(path) for path in paths]
+        self.paths = [Path(path) for path in paths]
+        self.cache_size = cache_size
+        self.columns = columns
+        self.bytes_read = 0
+        self.row_groups_read = 0
+        self.cache_hits = 0
+        self._cache: 'OrderedDict[RowGroupRef, pa.Table]' = OrderedDict()
+
+        refs, mins, maxs = [], [], []
+        for file_index, parquet_file in enumerate(self.files):
+            column = parquet_file.schema_arrow.get_field_index('media_id')
+            if column < 0:
+                raise ValueError(f"{self.paths[file_index]} has no media_id column; rebuild it with aggregate_parquet.py")
+            for rg in range(parquet_file.metadata.num_row_groups):
+                statistics = parquet_file.metadata.row_group(rg).column(column).statistics
+                if statistics is None or not statistics.has_min_max:
+                    continue
+                refs.append((file_index, rg))
+                mins.append(statistics.min)
+                maxs.append(statistics.max)
+        order = np.argsort(mins, kind='stable')
+        self._refs = [refs[i] for i in order]
+        self._mins = np.asarray(mins, dtype=np.int64)[order]
+        self._maxs = np.asarray(maxs, dtype=np.int64)[order]
+        # Running maximum of the upper bounds, so overlapping ranges are still found
+        self._max_prefix = np.maximum.accumulate(self._maxs) if len(self._maxs) else self._maxs
+
+    @classmethod
+    def open(cls, target: Path, **kwargs) -> 'RecordLookup':
+        """Lookup over one parquet file, or every parquet file under a directory (e.g. incremental parts)"""
+        target = Path(target)
+        paths = sorted(target.rglob('*.parquet')) if target.is_dir() else [target]
+        return cls(paths, **kwargs)
+
+    def candidates(self, media_id: int) -> List[RowGroupRef]:
+        """Row groups whose media_id range covers the ID"""
+        end = np.searchsorted(self._mins, media_id, side='right')
+        start = np.searchsorted(self._max_prefix[:end], media_id, side='left')
+        return [self._refs[i] for i in range(start, end) if self._maxs[i] >= media_id]
+
+    def _row_group(self, ref: RowGroupRef) -> pa.Table:
+        if ref in self._cache:
+            self._cache.move_to_end(ref)
+            self.cache_hits += 1
+            return self._cache[ref]
+        file_index, rg = ref
+        parquet_file = self.files[file_index]
+        table = parquet_file.read_row_group(rg, columns=self.columns and ['media_id', *self.columns])
+        metadata = parquet_file.metadata.row_group(rg)
+        names = set(table.column_names)
+        self.bytes_read += sum(metadata.column(i).total_compressed_size for i in range(metadata.num_columns)
+                               if metadata.column(i).path_in_schema in names)
+        self.row_groups_read += 1
+        if self.cache_size > 0:
+            self._cache[ref] = table
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return table
+
+    def get(self, media_id: int) -> Optional[Dict]:
+        """The record for a media ID, or None"""
+        for ref in self.candidates(media_id):
+            table = self._row_group(ref)
+            matches = table.filter(pc.equal(table.column('media_id'), media_id))
+            if matches.num_rows:
+                return matches.slice(0, 1).to_pylist()[0]
+        return None
+
+    def get_url(self, url: str) -> Optional[Dict]:
+        """The record for a media page URL"""
+        media_id = int(media_ids([url])[0])
+        return self.get(media_id) if media_id >= 0 else None
+
+def parse_key(key: str) -> int:
+    """A media ID given as digits (leading zeros allowed) or as a media page URL"""
+    if key.isdigit():
+        return int(key)
+    return int(media_ids([key])[0])
+
+def main():
+    parser = argparse.ArgumentParser(description='Look up records by media ID in the combined dataset')
+    parser.add_argument('target', help='Combined parquet file, or a directory of parts')
+    parser.add_argument('keys', nargs='+', help='Media IDs (e.g. 000705639) or media page URLs')
+    parser.add_argument('--columns', nargs='+', help='Only read these columns')
+    parser.add_argument('--cache-size', type=int, default=16, help='Decoded row groups kept in memory')
+    parser.add_argument('--debug', action='store_true', help='Enable debug logging')
+    args = parser.parse_args()
+
+    logger = setup_logging(level=logging.DEBUG if args.debug else logging.INFO)
+    lookup = RecordLookup.open(Path(args.target), cache_size=args.cache_size, columns=args.columns)
+    missing = 0
+    for key in args.keys:
+        media_id = parse_key(key)
+        record = lookup.get(media_id) if media_id >= 0 else None
+        if record is None:
+            logger.warning(f"No record for {key}")
+            missing += 1
+            continue
+        print(json.dumps(record, default=str))
+    logger.info(f"Read {lookup.row_groups_read} row group(s), {lookup.bytes_read:,} bytes "
+                f"({lookup.cache_hits} cache hit(s))")
+    return 1 if missing else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
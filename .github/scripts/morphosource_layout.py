@@ -0,0 +1,74 @@
+# Selectors for the two MorphoSource media page layouts
+PAGE_LAYOUTS = {
+    'showcase': {
+        'media_type_xpath': "//div[contains(@class, 'showcase-label')][contains(text(), 'Media type')]/following-sibling::div[contains(@class, 'showcase-value')]",
+        'field_xpath': "//div[contains(@class, 'showcase-label')][contains(text(), '{field}')]/following-sibling::div[1]",
+        'label_xpath': "//div[contains(@class, 'showcase-label')]",
+        'field_class': 'showcase-label',
+        'value_class': 'showcase-value'
+    },
+    'traditional': {
+        'media_type_xpath': "//div[@class='field-name'][contains(text(), 'Media type')]/following-sibling::div[@class='field-value']",
+        'field_xpath': "//div[@class='field-name'][contains(text(), '{field}')]/following-sibling::div[1]",
+        'label_xpath': "//div[@class='field-name']",
+        'field_class': 'field-name',
+        'value_class': 'field-value'
+    }
+}
+
+def get_fields_for_type(media_type):
+    """Get relevant fields based on media type"""
+    base_fields = {
+        'GENERAL DETAILS': [
+            'Media ID', 'Media type', 'Object element or part',
+            'Object represented', 'Object taxonomy', 'Object organization',
+            'Side', 'Orientation', 'Short description', 'Full description',
+            'Creator', 'Date created', 'Date uploaded'
+        ],
+        'OWNERSHIP AND PERMISSIONS': [
+            'Data managed by', 'Data uploaded by', 'Publication status',
+            'Download reviewer', 'IP holder', 'Copyright statement',
+            'Creative Commons license', 'Morphosource use agreement type',
+            'Permits commercial use', 'Permits 3D use',
+            'Required archival of published derivatives', 'Funding attribution',
+            'Publisher', 'Cite as', 'Media preview mode',
+            'Additional usage agreement'
+        ],
+        'IDENTIFIERS AND EXTERNAL LINKS': [
+            'MorphoSource ARK', 'MorphoSource DOI', 
+            'External identifier', 'External media URL'
+        ]
+    }
+    
+    if media_type.lower() == 'volumetric image series':
+        base_fields.update({
+            'FILE OBJECT DETAILS': [
+                'File name', 'File format(s)', 'File size', 'Image width',
+                'Image height', 'Color space', 'Color depth', 'Compression',
+                'X pixel spacing', 'Y pixel spacing', 'Z pixel spacing',
+                'Pixel spacing units', 'Slice thickness', 'Number of images in set'
+            ],
+            'IMAGE ACQUISITION AND PROCESSING AT A GLANCE': [
+                'Number of parent media', 'Number of processing events', 
+                'Modality', 'Device'
+            ]
+        })
+    elif media_type.lower() == 'mesh':
+        base_fields.update({
+            'FILE OBJECT DETAILS': [
+                'File name', 'File format(s)', 'File size',
+                'Points', 'Polygons', 'Map type', 'UV coordinates',
+                'Vertex color', 'Bounding box dimensions', 
+                'Centroid coordinates', 'Units of point coordinates'
+            ],
+            'IMAGE ACQUISITION AND PROCESSING AT A GLANCE': [
+                'Number of parent media', 'Number of processing events',
+                'Derived directly from', 'Modality', 'Device'
+            ]
+        })
+    
+    return base_fields
+
+def field_to_column(field):
+    """Convert a page field label to its column name"""
+    return field.lower().replace(' ', '_').replace('(', '').replace(')', '')
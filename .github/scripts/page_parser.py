@@ -0,0 +1,147 @@
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit
+
+from lxml import html as lxml_html
+
+from instrumentation import metrics
+from morphosource_layout import PAGE_LAYOUTS, get_fields_for_type, field_to_column
+
+# Elements that start a new line when a browser renders text
+LINE_BREAK_TAGS = ('br', 'div', 'p', 'li', 'tr')
+
+def element_text(elem):
+    """Return the first non-empty line of an element's text, like WebElement.text"""
+    for child in elem.iter(*LINE_BREAK_TAGS):
+        if child is not elem:
+            child.text = '\n' + (child.text or '')
+            child.tail = '\n' + (child.tail or '')
+    for line in elem.text_content().split('\n'):
+        line = ' '.join(line.split())
+        if line:
+            return line
+    return ''
+
+def build_field_map(tree, selectors):
+    """Walk every label/value pair once and map label text to value text"""
+    field_map = {}
+    for label in tree.xpath(selectors['label_xpath']):
+        key = ' '.join((label.text or '').split())
+        if not key or key in field_map:
+            continue
+        values = label.xpath('following-sibling::div[1]')
+        field_map[key] = element_text(values[0]) if values else None
+    return field_map
+
+def resolve_fields(field_map, sections):
+    """Look up the requested fields in a label map, falling back to substring matches"""
+    data = {}
+    for fields in sections.values():
+        for field in fields:
+            if field in field_map:
+                value = field_map[field]
+            else:
+                # Mirror the contains(text(), field) match of the per-field XPath
+                value = next((v for k, v in field_map.items() if field in k), None)
+            data[field_to_column(field)] = value
+    return data
+
+def detect_layout(tree, layouts=None):
+    """Return (layout, media type) for a parsed page, trying layouts in the given order"""
+    for layout_name in layouts or PAGE_LAYOUTS:
+        elems = tree.xpath(PAGE_LAYOUTS[layout_name]['media_type_xpath'])
+        if elems:
+            media_type = element_text(elems[0])
+            if media_type:
+                return layout_name, media_type
+    return None, None
+
+
+class LayoutCache:
+    """Learned layout per media-ID range, plus the field set for each media type.
+
+    Neighbouring media IDs were uploaded around the same time and share a
+    layout, so the layout last seen in a range is tried first. It is still
+    validated against the page, and the other layouts are only tried when
+    that check fails.
+    """
+
+    def __init__(self, bucket_size=1000):
+        self.bucket_size = bucket_size
+        self.hits = 0
+        self.misses = 0
+        self._layouts = {}
+        self._last = None
+        self._fields = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, url):
+        # Imported here so the processor's startup does not pay for work_catalog's pyarrow
+        from work_catalog import media_id
+        page_id = media_id(url)
+        if page_id is None:
+            return urlsplit(url).path.rsplit('/', 1)[0]
+        return page_id // self.bucket_size
+
+    def classify(self, tree, url):
+        """Return (layout, media type), trying the cached layout for this URL first"""
+        key = self.bucket(url)
+        hint = self._layouts.get(key, self._last)
+        order = [hint] + [name for name in PAGE_LAYOUTS if name != hint] if hint else list(PAGE_LAYOUTS)
+        layout_name, media_type = detect_layout(tree, order)
+        if layout_name is None:
+            return None, None
+        with self._lock:
+            if layout_name == hint:
+                self.hits += 1
+                metrics.count('layout_cache_hits')
+            else:
+                self.misses += 1
+                metrics.count('layout_cache_misses')
+            self._layouts[key] = layout_name
+            self._last = layout_name
+        return layout_name, media_type
+
+    def fields_for(self, media_type):
+        """Field sections for a media type, built once per type"""
+        key = media_type.lower()
+        sections = self._fields.get(key)
+        if sections is None:
+            sections = self._fields[key] = get_fields_for_type(media_type)
+        return sections
+
+
+# Shared by every worker thread in the process
+layout_cache = LayoutCache()
+
+def parse_page(page_html, url, logger):
+    """Parse a media page's HTML into a record dict"""
+    data = {
+        'url': url,
+        'processed_at': datetime.now().isoformat(),
+        'error': None
+    }
+    
+    with metrics.stage('layout'):
+        tree = lxml_html.fromstring(page_html)
+        title = tree.findtext('.//title') or ''
+        layout_used = None
+        media_type = None
+        if "Showcase Media" in title:
+            layout_used, media_type = layout_cache.classify(tree, url)
+    
+    if "Showcase Media" not in title:
+        data['error'] = "Not a valid MorphoSource media page"
+        return data
+    
+    if not layout_used or not media_type:
+        data['error'] = "Could not determine page layout or media type"
+        return data
+    
+    logger.debug("Detected layout %s, media type %s for %s", layout_used, media_type, url)
+    
+    with metrics.stage('extraction'):
+        field_map = build_field_map(tree, PAGE_LAYOUTS[layout_used])
+        data.update(resolve_fields(field_map, layout_cache.fields_for(media_type)))
+    
+    return data
@@ -0,0 +1,279 @@
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import quote
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from instrumentation import metrics
+
+
+class ParquetSink:
+    """Append records to a single parquet file, one row group per flush.
+
+    The file is opened lazily on the first flush and keeps a fixed schema for
+    its whole life, so a checkpoint only costs the rows buffered since the last
+    one. The footer is written by close(), which callers must reach on normal
+    exit as well as on SIGTERM/SIGINT. An optional `coerce` callable converts
+    each raw record to the schema's types before it is written.
+
+    With background=True, coercion, Arrow conversion and the row group write
+    happen on a writer thread fed through a queue of at most `queue_depth`
+    pending row groups, so write() only blocks when the writer falls behind.
+    A writer error is raised from the next write(), flush() or close().
+    An optional `on_flush` callable is called with the sink after each flush
+    hands its records on, on the thread that flushed.
+    """
+
+    def __init__(self, path, schema, flush_rows=100, flush_bytes=16 * 1024 * 1024,
+                 compression='snappy', coerce=None, logger=None, background=False, queue_depth=2,
+                 on_flush=None):
+        self.path = Path(path)
+        self.schema = schema
+        self.flush_rows = max(1, flush_rows)
+        self.flush_bytes = flush_bytes
+        self.compression = compression
+        self.coerce = coerce
+        self.on_flush = on_flush
+        self.logger = logger or logging.getLogger(__name__)
+        self.rows_written = 0
+        self.row_groups = 0
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._writer = None
+        self._closed = False
+        self._error = None
+        self._queue = None
+        self._thread = None
+        if background:
+            self._queue = queue.Queue(maxsize=max(1, queue_depth))
+            self._thread = threading.Thread(target=self._drain, name='parquet-writer', daemon=True)
+            self._thread.start()
+
+    def _raise_writer_error(self):
+        if self._error is not None:
+            raise RuntimeError(f"Writing {self.path} failed") from self._error
+
+    def write(self, record):
+        """Buffer a record, flushing once a row or byte threshold is reached"""
+        if self._closed:
+            raise ValueError(f"Sink {self.path} is already closed")
+        self._raise_writer_error()
+        if self.coerce is not None and self._queue is None:
+            with metrics.stage('serialization'):
+                record = self.coerce(record)
+        self._buffer.append(record)
+        self._buffer_bytes += sum(len(str(v)) for v in record.values() if v is not None)
+        if len(self._buffer) >= self.flush_rows or self._buffer_bytes >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        """Write buffered records as a new row group"""
+        self._raise_writer_error()
+        if not self._buffer:
+            return
+        records = self._buffer
+        self._buffer = []
+        self._buffer_bytes = 0
+        if self._queue is not None:
+            self._queue.put(records)
+        else:
+            self._write_row_group(records)
+        if self.on_flush is not None:
+            self.on_flush(self)
+
+    def _drain(self):
+        while True:
+            records = self._queue.get()
+            if records is None:
+                return
+            if self._error is not None:
+                # Keep draining so producers never block on a dead writer
+                continue
+            try:
+                if self.coerce is not None:
+                    with metrics.stage('serialization'):
+                        records = [self.coerce(record) for record in records]
+                self._write_row_group(records)
+            except Exception as e:
+                self.logger.error(f"Parquet writer for {self.path} failed: {e}", exc_info=True)
+                self._error = e
+
+    def _write_row_group(self, records):
+        with metrics.stage('flush'):
+            table = pa.Table.from_pylist(records, schema=self.schema)
+            if self._writer is None:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                self._writer = pq.ParquetWriter(self.path, self.schema, compression=self.compression)
+            self._writer.write_table(table)
+        self.rows_written += table.num_rows
+        self.row_groups += 1
+        self.logger.info(f"Flushed {table.num_rows} records to {self.path} ({self.rows_written} total)")
+
+    def close(self):
+        """Flush remaining records and write the parquet footer"""
+        if self._closed:
+            return
+        try:
+            if self._error is None:
+                self.flush()
+        finally:
+            self._closed = True
+            if self._thread is not None:
+                self._queue.put(None)
+                self._thread.join()
+            self._close_files()
+        self._raise_writer_error()
+
+    def _close_files(self):
+        if self._writer is not None:
+            self._writer.close()
+            self.logger.info(f"Closed {self.path}: {self.rows_written} records in {self.row_groups} row groups")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+# Directory value hive readers map back to null
+HIVE_DEFAULT_PARTITION = '__HIVE_DEFAULT_PARTITION__'
+MANIFEST_DIR = '_manifests'
+
+def partition_dir(key, value):
+    """One hive path segment such as media_type=Mesh"""
+    if value is None or value == '':
+        return f"{key}={HIVE_DEFAULT_PARTITION}"
+    return f"{key}={quote(str(value), safe='')}"
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class PartitionedParquetSink(ParquetSink):
+    """Append records to a hive-partitioned dataset, with a manifest per run.
+
+    `partition_by` maps a coerced record to an ordered dict of partition keys
+    and values; records land in `<root>/<key>=<value>/.../part-<run_id>-<n>.parquet`.
+    Keys that are also schema columns are dropped from the files, as hive
+    readers restore them from the path. Each flush writes one row group to
+    every partition it touches. At most `max_open_files` writers stay open;
+    writing to a partition whose writer was closed starts a new part file.
+
+    close() writes `<root>/_manifests/<run_id>.json` listing every part file
+    with its partition, row count, batch_index range, size and sha256. The
+    manifest is written last and only after a clean close, so part files
+    without one belong to a run that never finished.
+    """
+
+    def __init__(self, root, schema, partition_by, run_id, max_open_files=32, **kwargs):
+        super().__init__(root, schema, **kwargs)
+        self.partition_by = partition_by
+        self.run_id = run_id
+        self.max_open_files = max(1, max_open_files)
+        self.partition_columns = None
+        self.file_schema = None
+        self.parts = []
+        self._open = OrderedDict()
+        self._sequence = {}
+        self._failed = False
+
+    @property
+    def manifest_path(self):
+        return self.path / MANIFEST_DIR / f"{self.run_id}.json"
+
+    def _write_row_group(self, records):
+        try:
+            self._write_partitions(records)
+        except BaseException:
+            self._failed = True
+            raise
+
+    def _write_partitions(self, records):
+        with metrics.stage('flush'):
+            groups = {}
+            for record in records:
+                partition = self.partition_by(record)
+                groups.setdefault(tuple(partition.items()), []).append(record)
+            if self.file_schema is None:
+                keys = [key for key, _ in next(iter(groups))]
+                self.partition_columns = [key for key in keys if key in self.schema.names]
+                self.file_schema = pa.schema(
+                    [f for f in self.schema if f.name not in self.partition_columns], metadata=self.schema.metadata)
+            for partition, group in groups.items():
+                table = pa.Table.from_pylist(group, schema=self.file_schema)
+                writer, part = self._writer_for(partition)
+                writer.write_table(table)
+                indices = [r['batch_index'] for r in group if r.get('batch_index') is not None]
+                if indices:
+                    low, high = min(indices), max(indices)
+                    part['min_batch_index'] = low if part['min_batch_index'] is None else min(part['min_batch_index'], low)
+                    part['max_batch_index'] = high if part['max_batch_index'] is None else max(part['max_batch_index'], high)
+                part['rows'] += table.num_rows
+        self.rows_written += len(records)
+        self.row_groups += 1
+        self.logger.info(f"Flushed {len(records)} records to {len(groups)} partition(s) of {self.path} "
+                         f"({self.rows_written} total)")
+
+    def _writer_for(self, partition):
+        if partition in self._open:
+            self._open.move_to_end(partition)
+            return self._open[partition]
+        if len(self._open) >= self.max_open_files:
+            _, (writer, part) = self._open.popitem(last=False)
+            self._finish_part(writer, part)
+        sequence = self._sequence.get(partition, 0)
+        self._sequence[partition] = sequence + 1
+        directory = self.path.joinpath(*(partition_dir(key, value) for key, value in partition))
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"part-{self.run_id}-{sequence:03d}.parquet"
+        part = {
+            'path': path.relative_to(self.path).as_posix(),
+            'partition': dict(partition),
+            'rows': 0,
+            'min_batch_index': None,
+            'max_batch_index': None,
+        }
+        self._open[partition] = (pq.ParquetWriter(path, self.file_schema, compression=self.compression), part)
+        return self._open[partition]
+
+    def _finish_part(self, writer, part):
+        writer.close()
+        path = self.path / part['path']
+        part['size'] = path.stat().st_size
+        part['sha256'] = file_sha256(path)
+        self.parts.append(part)
+
+    def _close_files(self):
+        while self._open:
+            _, (writer, part) = self._open.popitem(last=False)
+            self._finish_part(writer, part)
+        if self._failed:
+            self.logger.error(f"Not writing a manifest for run {self.run_id} after a failed write")
+            return
+        manifest = {
+            'run_id': self.run_id,
+            'created_at': datetime.now().isoformat(),
+            'partition_columns': self.partition_columns or [],
+            'rows': sum(part['rows'] for part in self.parts),
+            'files': sorted(self.parts, key=lambda part: part['path']),
+        }
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.manifest_path.with_suffix('.json.tmp')
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp_path, self.manifest_path)
+        self.logger.info(f"Closed {self.path}: {manifest['rows']} records in {len(self.parts)} part file(s); "
+                         f"manifest {self.manifest_path}")
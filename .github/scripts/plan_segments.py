@@ -0,0 +1,139 @@
+import json
+import math
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+Range = Tuple[int, int]
+
+# One-sided 95% z-score, used to pad segment estimates for latency variance
+Z_95 = 1.645
+
+def records_within_budget(budget_seconds: float, mean_time: float, std_time: float = 0.0) -> int:
+    """Largest n whose total time n*mean + z*std*sqrt(n) still fits the budget"""
+    if budget_seconds <= 0:
+        return 0
+    if mean_time <= 0:
+        return 2 ** 31
+    # Solve mean*x^2 + z*std*x - budget = 0 for x = sqrt(n)
+    b = Z_95 * std_time
+    x = (-b + math.sqrt(b * b + 4 * mean_time * budget_seconds)) / (2 * mean_time)
+    return max(1, int(x * x))
+
+def latency_std(median_time: Optional[float], p95_time: Optional[float]) -> float:
+    """Rough per-record standard deviation from the median and 95th percentile"""
+    if median_time is None or p95_time is None or p95_time <= median_time:
+        return 0.0
+    return (p95_time - median_time) / Z_95
+
+def remaining_ranges(total: int, completed: List[Dict]) -> List[Range]:
+    """Parts of [0, total) not covered by completed segments"""
+    covered = sorted((int(c['start']), int(c['end'])) for c in completed)
+    ranges = []
+    cursor = 0
+    for start, end in covered:
+        if start > cursor:
+            ranges.append((cursor, min(start, total)))
+        cursor = max(cursor, end)
+    if cursor < total:
+        ranges.append((cursor, total))
+    return [(s, e) for s, e in ranges if e > s]
+
+def load_completed(path: str) -> List[Dict]:
+    """Finished segments from a JSON list, or from every segment_stats.json under a directory of artifacts"""
+    path = Path(path)
+    if not path.is_dir():
+        with open(path) as f:
+            return json.load(f)
+    completed = []
+    for stats_file in sorted(path.rglob('segment_stats.json')):
+        with open(stats_file) as f:
+            completed.append(json.load(f))
+    return completed
+
+def observed_record_time(completed: List[Dict]) -> Optional[float]:
+    """Wall time per record measured across finished segments"""
+    processed = sum(int(c.get('processed', 0)) for c in completed)
+    elapsed = sum(float(c.get('elapsed_seconds', 0)) for c in completed)
+    if processed <= 0 or elapsed <= 0:
+        return None
+    return elapsed / processed
+
+def plan_segments(ranges: List[Range], mean_time: float, max_concurrent: int, time_budget: float,
+                  std_time: float = 0.0, max_segment: int = 0, workers: int = 1) -> List[Range]:
+    """Split ranges into segments that each fit the time budget and keep every slot busy"""
+    total = sum(end - start for start, end in ranges)
+    if total <= 0:
+        return []
+    cap = records_within_budget(time_budget * max(1, workers), mean_time, std_time)
+    if max_segment > 0:
+        cap = min(cap, max_segment)
+
+    # Enough segments to respect the cap, rounded up to whole waves of concurrent jobs
+    count = max(math.ceil(total / cap), max_concurrent)
+    count = min(total, math.ceil(count / max_concurrent) * max_concurrent)
+    target = math.ceil(total / count)
+
+    segments = []
+    for start, end in ranges:
+        pieces = math.ceil((end - start) / target)
+        for i in range(pieces):
+            segments.append((start + (end - start) * i // pieces, start + (end - start) * (i + 1) // pieces))
+    return segments
+
+def segment_names(segments: List[Range]) -> List[str]:
+    """Names in the aggregator's '<start>k-<end>k' form, or raw bounds where those would collide"""
+    names = [f'{start // 1000}k-{end // 1000}k' for start, end in segments]
+    if len(set(names)) == len(names):
+        return names
+    return [f'{start}-{end}' for start, end in segments]
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan processor segments from measured throughput')
+    parser.add_argument('--total-records', type=int, required=True)
+    parser.add_argument('--max-concurrent', type=int, default=3)
+    parser.add_argument('--segment-size', type=int, default=0, help='Upper bound on records per segment (0 for none)')
+    parser.add_argument('--avg-time', type=float, required=True, help='Mean seconds per record from the test run')
+    parser.add_argument('--median-time', type=float, help='Median seconds per record from the test run')
+    parser.add_argument('--p95-time', type=float, help='95th percentile seconds per record from the test run')
+    parser.add_argument('--workers', type=int, default=1, help='Concurrent workers inside each processor job')
+    parser.add_argument('--time-limit-minutes', type=float, default=360, help='Runner job time limit')
+    parser.add_argument('--overhead-minutes', type=float, default=15, help='Setup and upload time per job')
+    parser.add_argument('--completed', help='JSON list of finished segments (start, end, processed, '
+                                            'elapsed_seconds), or a directory of segment_stats.json files, '
+                                            'to re-plan the remaining ranges from')
+    parser.add_argument('--output', default='segments.txt')
+    args = parser.parse_args()
+
+    time_budget = (args.time_limit_minutes - args.overhead_minutes) * 60
+    mean_time = args.avg_time
+    std_time = latency_std(args.median_time, args.p95_time)
+    ranges = [(0, args.total_records)]
+
+    if args.completed:
+        completed = load_completed(args.completed)
+        ranges = remaining_ranges(args.total_records, completed)
+        observed = observed_record_time(completed)
+        if observed is not None:
+            # Finished segments measured wall time for the whole job, workers included
+            mean_time = observed * max(1, args.workers)
+            print(f'Observed {observed:.2f}s per record across {len(completed)} finished segments')
+
+    segments = plan_segments(ranges, mean_time, max(1, args.max_concurrent), time_budget,
+                             std_time, args.segment_size, args.workers)
+
+    with open(args.output, 'w') as f:
+        for (start, end), name in zip(segments, segment_names(segments)):
+            f.write(f'{start},{end},{name}\n')
+
+    largest = max((end - start for start, end in segments), default=0)
+    total = sum(end - start for start, end in segments)
+    per_job = mean_time * largest / max(1, args.workers)
+    print(f'Created {len(segments)} segments covering {total} records (largest {largest})')
+    print(f'Average processing time per record: {mean_time:.2f}s (std estimate {std_time:.2f}s)')
+    print(f'Estimated time per workflow: {per_job / 3600:.2f} hours of a {time_budget / 3600:.2f} hour budget')
+    waves = math.ceil(len(segments) / max(1, args.max_concurrent))
+    print(f'Total estimated time: {waves * per_job / 3600:.2f} hours with {args.max_concurrent} concurrent workflows')
+
+if __name__ == '__main__':
+    main()
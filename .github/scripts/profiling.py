@@ -0,0 +1,233 @@
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from pathlib import Path
+
+# Frames of the profiler itself and of tracemalloc, left out of reports
+IGNORED_FILES = (tracemalloc.__file__, __file__, '<frozen importlib._bootstrap>',
+                 '<frozen importlib._bootstrap_external>')
+
+
+def frame_label(code):
+    """Flamegraph frame name: module:qualified function name"""
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{getattr(code, 'co_qualname', code.co_name)}"
+
+def thread_group(name):
+    """Pool thread names without their index, so worker_0 and worker_3 share one flamegraph root"""
+    return re.sub(r'_\d+$', '', name)
+
+
+class StackSampler:
+    """Wall-clock sampling profiler over every thread of the process.
+
+    A daemon thread wakes every `interval` seconds and records the stack of
+    each other thread, so worker, parser and writer threads are all covered
+    and blocked time (page loads, queue waits) shows up as well as CPU time.
+    The cost is one stack walk per thread per sample, independent of how much
+    work the run does; the sampler's own CPU time is reported with the
+    results. Stacks are written in the collapsed format read by
+    flamegraph.pl, speedscope and similar tools.
+    """
+
+    def __init__(self, interval=0.01, max_depth=64):
+        self.interval = interval
+        self.max_depth = max_depth
+        self.samples = 0
+        self.cpu_time = 0.0
+        self.wall_time = 0.0
+        self._stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+        self._started = None
+
+    def start(self):
+        self._started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+        self.wall_time = time.perf_counter() - self._started
+
+    def _run(self):
+        own = threading.get_ident()
+        cpu_start = time.thread_time()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None and len(stack) < self.max_depth:
+                    stack.append(frame_label(frame.f_code))
+                    frame = frame.f_back
+                stack.append(thread_group(names.get(ident, 'thread')))
+                self._stacks[';'.join(reversed(stack))] += 1
+            self.samples += 1
+        self.cpu_time = time.thread_time() - cpu_start
+
+    def write(self, path):
+        """Write one `root;...;leaf count` line per distinct stack"""
+        with open(path, 'w') as f:
+            for stack, count in self._stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class AllocationTracker:
+    """tracemalloc checkpoints, summarised as top-N allocation sites.
+
+    Every checkpoint records the traced totals, which is cheap. Grouping a
+    snapshot by site takes seconds once a few hundred thousand blocks are
+    live, so full snapshots are only taken while their cumulative cost stays
+    under `budget` of the run's wall time, plus one at the end. Only the
+    per-site totals of the first and latest snapshots are kept.
+    """
+
+    def __init__(self, top=25, frames=1, budget=0.05):
+        self.top = top
+        self.frames = frames
+        self.budget = budget
+        self.checkpoints = []
+        self.snapshots = 0
+        self.snapshot_time = 0.0
+        self._last_cost = 0.0
+        self._first = None
+        self._previous = None
+        self._started = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        self._started = time.perf_counter()
+        tracemalloc.start(self.frames)
+
+    def _sites(self):
+        """Live size and block count per allocation site"""
+        start = time.perf_counter()
+        sites = {}
+        for stat in tracemalloc.take_snapshot().statistics('lineno'):
+            frame = stat.traceback[0]
+            if frame.filename not in IGNORED_FILES:
+                sites[f'{frame.filename}:{frame.lineno}'] = (stat.size, stat.count)
+        self._last_cost = time.perf_counter() - start
+        self.snapshot_time += self._last_cost
+        self.snapshots += 1
+        return sites
+
+    def _growth(self, sites, since):
+        """Top sites by growth since an earlier snapshot, formatted for the report"""
+        growth = []
+        for site, (size, count) in sites.items():
+            old_size, old_count = since.get(site, (0, 0))
+            if size > old_size:
+                growth.append((size - old_size, count - old_count, size, site))
+        growth.sort(reverse=True)
+        return [f"{site}: +{diff / 1024:.1f} KiB ({blocks:+d} blocks), {size / 1024:.1f} KiB live"
+                for diff, blocks, size, site in growth[:self.top]]
+
+    def checkpoint(self, label, force=False):
+        """Record traced memory totals, and per-site growth when the snapshot budget allows"""
+        if not tracemalloc.is_tracing():
+            return
+        with self._lock:
+            current, peak = tracemalloc.get_traced_memory()
+            point = {'label': label, 'time': time.time(), 'current': current, 'peak': peak,
+                     'snapshot': False, 'growth': None}
+            elapsed = time.perf_counter() - self._started
+            if force or self.snapshot_time + self._last_cost <= self.budget * elapsed:
+                sites = self._sites()
+                point['snapshot'] = True
+                if self._previous is not None:
+                    point['growth'] = self._growth(sites, self._previous)
+                if self._first is None:
+                    self._first = sites
+                self._previous = sites
+            self.checkpoints.append(point)
+
+    def stop(self):
+        """Take a last snapshot and stop tracing"""
+        if not tracemalloc.is_tracing():
+            return
+        self.checkpoint('end', force=True)
+        tracemalloc.stop()
+
+    def write(self, path):
+        largest = sorted(self._previous.items(), key=lambda item: -item[1][0])[:self.top] if self._previous else []
+        with open(path, 'w') as f:
+            f.write(f"Allocation report: top {self.top} sites, {self.frames} frame(s) per trace, "
+                    f"{self.snapshots} snapshot(s) taking {self.snapshot_time:.1f} s\n\n")
+            f.write("Checkpoints (current / peak traced memory, * = snapshot taken):\n")
+            for point in self.checkpoints:
+                f.write(f"  {time.strftime('%H:%M:%S', time.localtime(point['time']))} {point['label']}: "
+                        f"{point['current'] / 2**20:.1f} MiB / {point['peak'] / 2**20:.1f} MiB"
+                        f"{' *' if point['snapshot'] else ''}\n")
+            f.write("\nLargest live allocation sites at the end:\n")
+            f.writelines(f"  {site}: {size / 1024:.1f} KiB in {count} blocks\n" for site, (size, count) in largest)
+            if self._first is not None and self._first is not self._previous:
+                f.write("\nGrowth since the first snapshot:\n")
+                f.writelines(f"  {line}\n" for line in self._growth(self._previous, self._first))
+            for point in self.checkpoints:
+                if point['growth']:
+                    f.write(f"\nGrowth up to {point['label']}:\n")
+                    f.writelines(f"  {line}\n" for line in point['growth'])
+
+
+class RunProfiler:
+    """Stack sampling plus allocation checkpoints for one processor run.
+
+    Disabled by default, in which case create_sink()'s flush hook skips it
+    and nothing is sampled or traced. When enabled, the reports are written
+    next to the log file (<log stem>.profile.collapsed and
+    <log stem>.alloc.txt) so they end up in the same artifact.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.sampler = None
+        self.allocations = None
+        self.prefix = None
+        self.flushes = 0
+
+    def enable(self, log_file, interval=0.01, top=25, frames=1):
+        log_file = Path(log_file)
+        self.prefix = log_file.parent / log_file.stem
+        self.sampler = StackSampler(interval)
+        self.allocations = AllocationTracker(top, frames)
+        self.enabled = True
+        self.allocations.start()
+        self.sampler.start()
+        self.allocations.checkpoint('start', force=True)
+
+    def on_flush(self, sink):
+        """Sink flush hook: checkpoint allocations once per flush"""
+        self.flushes += 1
+        self.allocations.checkpoint(f'flush {self.flushes}')
+
+    def finish(self, logger):
+        """Stop profiling and write both reports"""
+        if not self.enabled:
+            return
+        self.enabled = False
+        self.sampler.stop()
+        self.allocations.stop()
+        stacks_file = Path(f'{self.prefix}.profile.collapsed')
+        alloc_file = Path(f'{self.prefix}.alloc.txt')
+        stacks_file.parent.mkdir(parents=True, exist_ok=True)
+        self.sampler.write(stacks_file)
+        self.allocations.write(alloc_file)
+        overhead = self.sampler.cpu_time / self.sampler.wall_time if self.sampler.wall_time else 0.0
+        logger.info(f"Wrote {self.sampler.samples} stack samples to {stacks_file} (sampler CPU {overhead:.1%} "
+                    f"of wall time) and {self.allocations.snapshots} allocation snapshots to {alloc_file} "
+                    f"({self.allocations.snapshot_time:.1f} s)")
+
+
+# Shared by the processor and create_sink(); main() enables it for --profile
+profiler = RunProfiler()
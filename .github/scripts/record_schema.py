@@ -0,0 +1,169 @@
+import logging
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+
+import pyarrow as pa
+
+from instrumentation import RECORD_STAGES, metrics, stage_column
+from morphosource_layout import get_fields_for_type, field_to_column
+from work_catalog import media_id
+
+logger = logging.getLogger(__name__)
+
+# Columns every record carries in addition to the page fields
+RECORD_META_COLUMNS = [
+    ('url', pa.string()),
+    ('processed_at', pa.timestamp('us')),
+    ('error', pa.string()),
+    ('batch_index', pa.int64()),
+    ('attempt', pa.int64()),
+    ('processing_time', pa.float64()),
+]
+
+# Per-record stage timings, present only when instrumentation is enabled
+STAGE_TIMING_COLUMNS = [(stage_column(stage), pa.float64()) for stage in RECORD_STAGES]
+
+INTEGER_COLUMNS = {
+    'image_width', 'image_height', 'number_of_images_in_set', 'points', 'polygons',
+    'number_of_parent_media', 'number_of_processing_events',
+}
+FLOAT_COLUMNS = {'x_pixel_spacing', 'y_pixel_spacing', 'z_pixel_spacing', 'slice_thickness'}
+SIZE_COLUMNS = {'file_size'}
+
+# Columns with a handful of distinct values across the catalog
+DICTIONARY_COLUMNS = {
+    'media_type', 'modality', 'device', 'publication_status', 'side', 'orientation',
+    'color_space', 'color_depth', 'compression', 'pixel_spacing_units', 'file_formats',
+    'creative_commons_license', 'morphosource_use_agreement_type', 'permits_commercial_use',
+    'permits_3d_use', 'required_archival_of_published_derivatives', 'media_preview_mode',
+    'map_type', 'uv_coordinates', 'vertex_color', 'units_of_point_coordinates',
+    'download_reviewer', 'data_managed_by', 'publisher',
+}
+
+SIZE_UNITS = {
+    '': 1, 'b': 1, 'byte': 1, 'bytes': 1,
+    'kb': 1024, 'mb': 1024 ** 2, 'gb': 1024 ** 3, 'tb': 1024 ** 4,
+    'kib': 1024, 'mib': 1024 ** 2, 'gib': 1024 ** 3, 'tib': 1024 ** 4,
+}
+NUMBER_PATTERN = re.compile(r'-?(?:\d[\d,]*)?\.?\d+(?:[eE][-+]?\d+)?')
+SIZE_PATTERN = re.compile(r'^\s*(-?[\d,]*\.?\d+)\s*([a-zA-Z]*)')
+
+def parse_number(value):
+    """Parse the first number in a string such as '0.0321 mm' or '120,332'"""
+    match = NUMBER_PATTERN.search(value)
+    if not match:
+        raise ValueError(f"No number in {value!r}")
+    return float(match.group().replace(',', ''))
+
+def parse_int(value):
+    number = parse_number(value)
+    if not number.is_integer():
+        raise ValueError(f"{value!r} is not an integer")
+    return int(number)
+
+def parse_size(value):
+    """Parse a human-readable size such as '12.3 MB' into bytes"""
+    match = SIZE_PATTERN.match(value)
+    unit = match.group(2).lower() if match else None
+    if unit not in SIZE_UNITS:
+        raise ValueError(f"Unrecognized size {value!r}")
+    return int(round(float(match.group(1).replace(',', '')) * SIZE_UNITS[unit]))
+
+def parse_timestamp(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(value)
+
+def column_type(column_name):
+    """Arrow type for a page field column"""
+    if column_name in INTEGER_COLUMNS or column_name in SIZE_COLUMNS:
+        return pa.int64()
+    if column_name in FLOAT_COLUMNS:
+        return pa.float64()
+    if column_name in DICTIONARY_COLUMNS:
+        return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+def build_record_schema(stage_timings=False):
+    """Build the fixed, typed parquet schema covering the fields of every media type"""
+    columns = list(RECORD_META_COLUMNS)
+    if stage_timings:
+        columns.extend(STAGE_TIMING_COLUMNS)
+    seen = {name for name, _ in columns}
+    for media_type in ('volumetric image series', 'mesh', ''):
+        for fields in get_fields_for_type(media_type).values():
+            for field in fields:
+                column_name = field_to_column(field)
+                if column_name not in seen:
+                    seen.add(column_name)
+                    columns.append((column_name, column_type(column_name)))
+    return pa.schema(columns)
+
+# Media IDs per url_bucket partition of the output dataset
+URL_BUCKET_SIZE = 100000
+
+def record_partition(record):
+    """Hive partition of a record in the output dataset: its media type and media ID range"""
+    page_id = media_id(record.get('url') or '')
+    return {
+        'media_type': record.get('media_type'),
+        'url_bucket': page_id // URL_BUCKET_SIZE if page_id is not None else None,
+    }
+
+class CoercionFailures:
+    """Per-column counts of values coerce_record could not parse, for the run and since the last report
+
+    Failing values are common for a column the site changed the format of, so
+    they are logged once per report (the sink's flush hook) rather than once
+    per value, and counted in the run metrics as coercion_failures_<column>.
+    """
+
+    def __init__(self):
+        self.totals = Counter()
+        self._pending = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, column):
+        with self._lock:
+            self.totals[column] += 1
+            self._pending[column] += 1
+        metrics.count(f'coercion_failures_{column}')
+
+    def report(self, log=None):
+        """Log the failures counted since the last report at WARNING; returns them"""
+        with self._lock:
+            pending, self._pending = self._pending, Counter()
+        if pending:
+            counts = ', '.join(f'{column}: {n}' for column, n in pending.most_common())
+            (log or logger).warning(f"Wrote {sum(pending.values())} unparseable value(s) as null ({counts})")
+        return pending
+
+# Shared by every sink in the process
+coercion_failures = CoercionFailures()
+
+VALUE_PARSERS = {column: parse_int for column in INTEGER_COLUMNS}
+VALUE_PARSERS.update({column: parse_number for column in FLOAT_COLUMNS})
+VALUE_PARSERS.update({column: parse_size for column in SIZE_COLUMNS})
+VALUE_PARSERS['processed_at'] = parse_timestamp
+
+def coerce_record(record):
+    """Return a copy of a raw record with values parsed to their schema types
+
+    Values that cannot be parsed become null rather than failing the write,
+    and are counted in coercion_failures.
+    """
+    coerced = dict(record)
+    for column, parser in VALUE_PARSERS.items():
+        value = coerced.get(column)
+        if value is None or value == '':
+            coerced[column] = None
+            continue
+        if not isinstance(value, str) and column != 'processed_at':
+            continue
+        try:
+            coerced[column] = parser(value)
+        except (ValueError, TypeError):
+            logger.debug(f"Could not parse {column}={value!r} for {record.get('url')}")
+            coercion_failures.add(column)
+            coerced[column] = None
+    return coerced
@@ -0,0 +1,115 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+from collections import namedtuple
+from pathlib import Path
+
+from instrumentation import RECORD_STAGES, metrics, stage_column
+
+# Per-run bookkeeping that should not affect a record's content hash
+VOLATILE_COLUMNS = {'processed_at', 'processing_time', 'attempt', 'batch_index', 'error'}
+VOLATILE_COLUMNS.update(stage_column(stage) for stage in RECORD_STAGES)
+
+# What a refresh needs to know about a cached URL without loading its record
+CacheEntry = namedtuple('CacheEntry', ['content_hash', 'etag', 'last_modified', 'fetched_at'])
+
+def content_hash(record):
+    """Hash the extracted fields of a record, ignoring per-run bookkeeping"""
+    content = {k: v for k, v in record.items() if k not in VOLATILE_COLUMNS}
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class ResultCache:
+    """On-disk URL -> record cache so reruns can skip pages that were already extracted"""
+
+    def __init__(self, path, ttl=30 * 24 * 3600, max_entries=500000, logger=None):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.logger = logger or logging.getLogger(__name__)
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS results (
+                url TEXT PRIMARY KEY,
+                record TEXT NOT NULL,
+                content_hash TEXT NOT NULL,
+                fetched_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS results_fetched_at ON results (fetched_at)')
+        columns = {row[1] for row in self._conn.execute('PRAGMA table_info(results)')}
+        for column in ('etag', 'last_modified'):
+            if column not in columns:
+                # Caches written before HTTP validators were stored
+                self._conn.execute(f'ALTER TABLE results ADD COLUMN {column} TEXT')
+        self._conn.commit()
+
+    def get(self, url, max_age=None):
+        """Return the cached record for a URL, or None if missing or older than max_age seconds"""
+        row = self._conn.execute(
+            'SELECT record, fetched_at FROM results WHERE url = ?', (url,)).fetchone()
+        if row is None or (max_age is not None and time.time() - row[1] > max_age):
+            self.misses += 1
+            metrics.count('cache_misses')
+            return None
+        self.hits += 1
+        metrics.count('cache_hits')
+        return json.loads(row[0])
+
+    def entry(self, url):
+        """Fingerprint and HTTP validators of a cached URL, or None"""
+        row = self._conn.execute(
+            'SELECT content_hash, etag, last_modified, fetched_at FROM results WHERE url = ?', (url,)).fetchone()
+        return CacheEntry(*row) if row is not None else None
+
+    def put(self, record, validators=None):
+        """Store a successfully extracted record with the ETag/Last-Modified it was served with"""
+        validators = validators or {}
+        self._conn.execute(
+            'INSERT OR REPLACE INTO results (url, record, content_hash, fetched_at, etag, last_modified) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (record['url'], json.dumps(record, default=str), content_hash(record), time.time(),
+             validators.get('etag'), validators.get('last_modified')))
+        self._conn.commit()
+
+    def touch(self, url, validators=None):
+        """Mark a cached record as confirmed unchanged now, keeping newer validators if the server sent any"""
+        validators = validators or {}
+        self._conn.execute(
+            'UPDATE results SET fetched_at = ?, etag = COALESCE(?, etag), '
+            'last_modified = COALESCE(?, last_modified) WHERE url = ?',
+            (time.time(), validators.get('etag'), validators.get('last_modified'), url))
+        self._conn.commit()
+
+    def delete(self, url):
+        self._conn.execute('DELETE FROM results WHERE url = ?', (url,))
+        self._conn.commit()
+
+    def evict(self):
+        """Drop entries past the TTL, then the oldest entries beyond max_entries"""
+        removed = 0
+        if self.ttl:
+            removed += self._conn.execute(
+                'DELETE FROM results WHERE fetched_at < ?', (time.time() - self.ttl,)).rowcount
+        if self.max_entries:
+            removed += self._conn.execute("""
+                DELETE FROM results WHERE url IN (
+                    SELECT url FROM results ORDER BY fetched_at DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,)).rowcount
+        self._conn.commit()
+        if removed:
+            self.logger.info(f"Evicted {removed} entries from result cache {self.path}")
+        return removed
+
+    def close(self):
+        self.evict()
+        self._conn.close()
+        self.logger.info(f"Result cache {self.path}: {self.hits} hits, {self.misses} misses")
@@ -0,0 +1,88 @@
+import heapq
+import itertools
+import random
+import time
+
+PERMANENT = 'permanent'
+RETRYABLE = 'retryable'
+
+# Extraction errors that will not go away by asking again
+PERMANENT_ERRORS = (
+    "Not a valid MorphoSource media page",
+    "Could not determine page layout or media type",
+)
+PERMANENT_STATUSES = {400, 401, 403, 404, 410}
+
+# WebDriver errors after which the driver itself is unusable
+FATAL_CLIENT_ERRORS = (
+    'invalid session id',
+    'chrome not reachable',
+    'no such window',
+    'disconnected',
+    'session deleted',
+)
+
+def error_status(error):
+    """HTTP status attached to a requests or aiohttp error, if any"""
+    response = getattr(error, 'response', None)
+    return getattr(response, 'status_code', None) or getattr(error, 'status', None)
+
+def classify_error(error):
+    """Classify an extraction error message or exception as permanent or retryable"""
+    if isinstance(error, str):
+        return PERMANENT if error.startswith(PERMANENT_ERRORS) else RETRYABLE
+    if error_status(error) in PERMANENT_STATUSES:
+        return PERMANENT
+    return RETRYABLE
+
+def is_timeout(error):
+    """Whether an error was caused by a page or request timeout"""
+    if isinstance(error, str):
+        return 'timeout' in error.lower() or 'timed out' in error.lower()
+    return isinstance(error, TimeoutError) or 'Timeout' in type(error).__name__
+
+def is_client_fatal(error):
+    """Whether an error means the driver or session must be replaced right away"""
+    message = str(error).lower()
+    return any(fatal in message for fatal in FATAL_CLIENT_ERRORS)
+
+def backoff_delay(attempt, base_delay=1.0, max_delay=30.0):
+    """Exponential backoff with full jitter for the given 1-based attempt"""
+    return random.uniform(0, min(max_delay, base_delay * 2 ** (attempt - 1)))
+
+
+class RetryScheduler:
+    """Deferred retry queue: failed items wait out their backoff while the batch moves on"""
+
+    def __init__(self, max_attempts=3, base_delay=1.0, max_delay=30.0):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deferred = 0
+        self._heap = []
+        self._counter = itertools.count()
+
+    def __len__(self):
+        return len(self._heap)
+
+    def defer(self, item, attempts):
+        """Queue an item for another attempt; False once its attempts are used up"""
+        if attempts >= self.max_attempts:
+            return False
+        ready_at = time.monotonic() + backoff_delay(attempts, self.base_delay, self.max_delay)
+        heapq.heappush(self._heap, (ready_at, next(self._counter), item))
+        self.deferred += 1
+        return True
+
+    def pop_ready(self):
+        """Wait for the earliest deferred item, then return every item that is due"""
+        if not self._heap:
+            return []
+        delay = self._heap[0][0] - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        now = time.monotonic()
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            ready.append(heapq.heappop(self._heap)[2])
+        return ready
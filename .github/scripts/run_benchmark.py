@@ -0,0 +1,355 @@
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import platform
+import resource
+import subprocess
+import tempfile
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+import pyarrow.parquet as pq
+
+SCRIPTS_DIR = Path(__file__).parent
+FIXTURES_DIR = SCRIPTS_DIR / 'fixtures' / 'pages'
+DEFAULT_BASELINE = SCRIPTS_DIR / 'fixtures' / 'benchmark_baseline.json'
+SCENARIOS = ('parse', 'http', 'async', 'fake-selenium', 'selenium', 'startup')
+DEFAULT_SCENARIOS = ('parse', 'http', 'async', 'fake-selenium', 'startup')
+# Processor launches per startup measurement; the median is reported
+STARTUP_RUNS = 5
+
+# Metrics compared against the baseline, and whether bigger is better
+COMPARED_METRICS = {
+    'records_per_sec': True,
+    'latency_p95': False,
+    'peak_rss_mb': False,
+    'import_seconds': False,
+    'no_work_seconds': False,
+    'first_record_seconds': False,
+}
+
+def setup_logging(level=logging.INFO):
+    """Configure logging for the script"""
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def load_manifest():
+    with open(FIXTURES_DIR / 'manifest.json') as f:
+        return json.load(f)
+
+def percentile(values, q):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * len(ordered) + 0.5)) - 1))]
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == 'darwin' else rss / 1024
+
+def check_record(record, expected):
+    """Names of expected fields whose parsed value differs from the manifest"""
+    return [field for field, value in expected.get('fields', {}).items() if record.get(field) != value]
+
+def summarize(latencies, records, elapsed, expected_records, mismatches):
+    return {
+        'records': records,
+        'expected_records': expected_records,
+        'elapsed_seconds': elapsed,
+        'records_per_sec': records / elapsed if elapsed else 0.0,
+        'latency_p50': percentile(latencies, 0.50),
+        'latency_p95': percentile(latencies, 0.95),
+        'latency_p99': percentile(latencies, 0.99),
+        'peak_rss_mb': peak_rss_mb(),
+        'mismatches': mismatches,
+    }
+
+def bench_parse(options):
+    """Parse every fixture in turn, without any network, to time the extraction code alone"""
+    from page_parser import parse_page
+    logger = logging.getLogger('benchmark')
+    manifest = load_manifest()
+    corpus = [(name, (FIXTURES_DIR / name).read_text(), expected) for name, expected in manifest.items()]
+
+    latencies = []
+    records = 0
+    expected_records = 0
+    mismatches = []
+    start = time.perf_counter()
+    for i in range(options['records']):
+        name, page_html, expected = corpus[i % len(corpus)]
+        page_start = time.perf_counter()
+        try:
+            data = parse_page(page_html, f'fixture://{name}', logger)
+        except Exception as e:
+            # Empty and unparseable bodies raise; the processor turns that into a failed URL
+            data = {'error': str(e)}
+        latencies.append(time.perf_counter() - page_start)
+        expected_records += expected['expect'] == 'record'
+        if data.get('error') is None:
+            records += 1
+            if i < len(corpus):
+                mismatches += [f'{name}:{field}' for field in check_record(data, expected)]
+    return summarize(latencies, records, time.perf_counter() - start, expected_records, mismatches)
+
+def start_standin_server(options):
+    """Run the stand-in server in its own process so it does not skew CPU or RSS numbers"""
+    command = [
+        sys.executable, str(SCRIPTS_DIR / 'standin_server.py'),
+        '--latency', str(options['latency']),
+        '--jitter', str(options['jitter']),
+        '--failure-rate', str(options['failure_rate']),
+        '--throttle-rate', str(options['throttle_rate']),
+        '--seed', str(options['seed']),
+    ]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    return server, server.stdout.readline().strip()
+
+def bench_batch(options):
+    """Run a whole processor batch against the stand-in server and read back what it wrote"""
+    import test_parquet_processor as processor
+    from record_schema import coerce_record
+    from standin_server import fixture_for
+
+    if options['scenario'] == 'fake-selenium':
+        # Drive the selenium code path and driver manager without Chrome
+        from fake_driver import FakeDriver
+        processor.setup_driver = lambda: FakeDriver(start_delay=options['fake_driver_start'])
+
+    # Invalid fixtures log a warning per page by design; keep the report readable
+    logger = logging.getLogger('benchmark.processor')
+    logger.setLevel(logging.ERROR)
+    manifest = load_manifest()
+    names = list(manifest)
+    count = options['records']
+    expected_records = sum(manifest[fixture_for(i, names)]['expect'] == 'record' for i in range(count))
+
+    server, base_url = start_standin_server(options)
+    try:
+        urls = [f'{base_url}/concern/media/{i:09d}' for i in range(count)]
+        with tempfile.TemporaryDirectory() as tmp:
+            output_dir = Path(tmp)
+            start = time.perf_counter()
+            if options['scenario'] == 'async':
+                processor.process_url_batch_async(
+                    urls, output_dir, logger, 0, 0, count,
+                    concurrency=options['workers'],
+                    max_concurrency=max(options['workers'], 32),
+                    rate_limit=10000.0
+                )
+            else:
+                processor.process_url_batch(
+                    urls, output_dir, logger, 0, 0, count,
+                    engine='http' if options['scenario'] == 'http' else 'selenium',
+                    workers=options['workers'],
+                    driver_max_pages=options['driver_max_pages']
+                )
+            elapsed = time.perf_counter() - start
+            files = list(output_dir.glob('*.parquet'))
+            rows = pq.read_table(files[0]).to_pylist() if files else []
+    finally:
+        server.terminate()
+        server.wait()
+
+    mismatches = []
+    checked = set()
+    for row in rows:
+        name = fixture_for(int(row['url'].rsplit('/', 1)[-1]), names)
+        if name not in checked:
+            checked.add(name)
+            # The sink parses typed columns, so parse the expected values the same way
+            fields = manifest[name].get('fields', {})
+            typed = coerce_record(fields)
+            mismatches += [f'{name}:{field}' for field in check_record(row, {'fields': {k: typed[k] for k in fields}})]
+            # A fixture value written as null was lost, e.g. it no longer parses
+            mismatches += [f'{name}:{field} is null' for field, value in fields.items()
+                           if value is not None and typed[field] is None]
+    latencies = [row['processing_time'] for row in rows if row['processing_time'] is not None]
+    return summarize(latencies, len(rows), elapsed, expected_records, mismatches)
+
+def timed_run(command, cwd):
+    """Wall time of a command run to completion"""
+    start = time.perf_counter()
+    subprocess.run(command, cwd=cwd, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+def bench_startup(options):
+    """Time the processor's fixed cost per launch: importing it, a run with no work left and a one-record run"""
+    processor = str(SCRIPTS_DIR / 'test_parquet_processor.py')
+    import_command = [sys.executable, '-c', 'import time; start = time.perf_counter(); '
+                      'import test_parquet_processor; print(time.perf_counter() - start)']
+    server, base_url = start_standin_server(options)
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            tmp = Path(tmp)
+            (tmp / 'data').mkdir()
+            with open(tmp / 'data' / 'morphosource_data_complete.json', 'w') as f:
+                json.dump([{'url': f'{base_url}/concern/media/{i:09d}'} for i in range(options['records'])], f)
+            command = [sys.executable, processor, '--output-dir', str(tmp / 'out'),
+                       '--log-file', str(tmp / 'processor.log')]
+            # The workflow restores the URL index from cache, so build it outside the timings
+            timed_run(command + ['--build-index'], tmp)
+
+            imports, no_work, first_record = [], [], []
+            for _ in range(STARTUP_RUNS):
+                output = subprocess.run(import_command, cwd=SCRIPTS_DIR, check=True, capture_output=True, text=True)
+                imports.append(float(output.stdout))
+                no_work.append(timed_run(command + ['--total-target', '10', '--total-processed', '10'], tmp))
+                first_record.append(timed_run(command + ['--engine', 'http', '--max-records', '1',
+                                                         '--batch-size', '1'], tmp))
+            records = sum(pq.read_metadata(path).num_rows for path in (tmp / 'out').glob('*.parquet'))
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        'records': records,
+        'expected_records': STARTUP_RUNS,
+        'import_seconds': percentile(imports, 0.50),
+        'no_work_seconds': percentile(no_work, 0.50),
+        'first_record_seconds': percentile(first_record, 0.50),
+        'mismatches': [],
+    }
+
+def run_scenario(options):
+    """Run one scenario; called in a fresh process so peak RSS is its own"""
+    sys.path.insert(0, str(SCRIPTS_DIR))
+    logging.basicConfig(level=logging.WARNING)
+    if options['scenario'] == 'parse':
+        return bench_parse(options)
+    if options['scenario'] == 'startup':
+        return bench_startup(options)
+    return bench_batch(options)
+
+def compare(results, baseline, threshold):
+    """List every compared metric that is worse than the baseline by more than threshold"""
+    regressions = []
+    for scenario, metrics in results.items():
+        base = baseline.get('scenarios', {}).get(scenario)
+        if not base:
+            continue
+        for metric, higher_is_better in COMPARED_METRICS.items():
+            current, previous = metrics.get(metric), base.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(f"{scenario} {metric}: {previous:.4g} -> {current:.4g} ({change:+.1%})")
+    return regressions
+
+def host_info():
+    """The machine a run was timed on; timings only gate against a baseline from the same one"""
+    return {
+        'node': platform.node(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'python': platform.python_version(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the processor against recorded pages served locally')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(DEFAULT_SCENARIOS),
+                        help='parse times the parser alone; startup times processor launches; the others '
+                             'run a batch with that engine, fake-selenium with a stand-in for Chrome')
+    parser.add_argument('--records', type=int, default=140, help='Pages per scenario')
+    parser.add_argument('--parse-records', type=int, default=2000, help='Pages for the parse scenario')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05, help='Mean stand-in server latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.02, help='Standard deviation of the server latency')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests failing with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests throttled with 429')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--fake-driver-start', type=float, default=0.5,
+                        help='Simulated driver start time for the fake-selenium scenario')
+    parser.add_argument('--driver-max-pages', type=int, default=200,
+                        help='Recycle drivers after this many pages in the selenium scenarios')
+    parser.add_argument('--baseline', default=str(DEFAULT_BASELINE), help='Baseline JSON to compare against')
+    parser.add_argument('--threshold', type=float, default=0.25,
+                        help='Fail when a metric is worse than the baseline by more than this fraction; '
+                             'only enforced against a baseline recorded on this machine')
+    parser.add_argument('--update-baseline', action='store_true', help='Write these results as the new baseline')
+    parser.add_argument('--output', help='Write the results JSON here')
+    args = parser.parse_args()
+
+    logger = setup_logging()
+    config = {
+        'workers': args.workers,
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'failure_rate': args.failure_rate,
+        'throttle_rate': args.throttle_rate,
+        'seed': args.seed,
+        'fake_driver_start': args.fake_driver_start,
+        'driver_max_pages': args.driver_max_pages,
+    }
+
+    results = {}
+    context = multiprocessing.get_context('spawn')
+    for scenario in args.scenarios:
+        options = dict(config, scenario=scenario,
+                       records=args.parse_records if scenario == 'parse' else args.records)
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            result = pool.submit(run_scenario, options).result()
+        results[scenario] = result
+        if scenario == 'startup':
+            logger.info(f"startup: import {result['import_seconds']:.3f}s, "
+                        f"no-work run {result['no_work_seconds']:.3f}s, "
+                        f"first record {result['first_record_seconds']:.3f}s")
+            continue
+        logger.info(f"{scenario}: {result['records']}/{result['expected_records']} records, "
+                    f"{result['records_per_sec']:.1f} records/s, "
+                    f"p50 {result['latency_p50'] or 0:.4f}s, p95 {result['latency_p95'] or 0:.4f}s, "
+                    f"p99 {result['latency_p99'] or 0:.4f}s, peak RSS {result['peak_rss_mb']:.1f} MB")
+
+    report = {'config': config, 'host': host_info(), 'scenarios': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failures = []
+    for scenario, result in results.items():
+        if result['mismatches']:
+            failures.append(f"{scenario} extracted wrong values: {', '.join(result['mismatches'])}")
+        if not args.failure_rate and not args.throttle_rate and result['records'] != result['expected_records']:
+            failures.append(f"{scenario} wrote {result['records']} records, expected {result['expected_records']}")
+
+    if args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Saved baseline to {args.baseline}")
+    elif Path(args.baseline).exists():
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != config:
+            logger.warning(f"Baseline was recorded with {baseline.get('config')}, comparing anyway")
+        regressions = compare(results, baseline, args.threshold)
+        if baseline.get('host') == report['host']:
+            failures += [f"Regression in {r}" for r in regressions]
+        else:
+            # Absolute timings from another machine say more about the machine than the code
+            logger.warning(f"Baseline was recorded on {baseline.get('host') or 'an unknown host'}, not this one "
+                           f"({report['host']}); reporting regressions without failing. Run with "
+                           f"--update-baseline here to enforce the {args.threshold:.0%} threshold")
+            for regression in regressions:
+                logger.warning(f"Regression in {regression}")
+    else:
+        logger.warning(f"No baseline at {args.baseline}; run with --update-baseline to record one")
+
+    for failure in failures:
+        logger.error(failure)
+    return 1 if failures else 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,212 @@
+import abc
+import logging
+import sqlite3
+import threading
+import time
+from collections import namedtuple
+from pathlib import Path
+
+# A contiguous chunk of URL indices, [start, end)
+Shard = namedtuple('Shard', ['id', 'start', 'end', 'claims'])
+
+
+class LeaseLost(Exception):
+    """The worker's lease on its shard ran out; another worker may already be processing it"""
+
+
+class ShardQueue(abc.ABC):
+    """Lease-based queue of URL index chunks shared by several workers.
+
+    A worker claims a shard, renews its lease while working on it and marks
+    it done at the end. A shard whose lease runs out (its worker crashed or
+    was killed) goes back to the queue for the next claim. Backends implement
+    the methods below; SQLiteShardQueue is the local, file-based one.
+    """
+
+    @abc.abstractmethod
+    def seed(self, start, end, chunk_size):
+        """Split [start, end) into shards unless the queue already has them"""
+
+    @abc.abstractmethod
+    def claim(self, owner):
+        """Lease the next available shard to `owner`, or return None when nothing is left to claim"""
+
+    @abc.abstractmethod
+    def renew(self, shard, owner):
+        """Extend the lease on a shard; returns False if `owner` no longer holds it"""
+
+    @abc.abstractmethod
+    def complete(self, shard, owner):
+        """Mark a leased shard as done"""
+
+    @abc.abstractmethod
+    def release(self, shard, owner):
+        """Give a leased shard back so another worker can claim it"""
+
+    @abc.abstractmethod
+    def counts(self):
+        """Number of shards in each state"""
+
+    def close(self):
+        pass
+
+
+class SQLiteShardQueue(ShardQueue):
+    """ShardQueue stored in a SQLite file that every local worker process opens"""
+
+    def __init__(self, path, lease_seconds=300, max_claims=3, logger=None):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_claims = max(1, max_claims)
+        self.logger = logger or logging.getLogger(__name__)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Renewals come from the lease keeper thread, so share one guarded connection
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS shards (
+                id INTEGER PRIMARY KEY,
+                start INTEGER NOT NULL,
+                end INTEGER NOT NULL,
+                state TEXT NOT NULL DEFAULT 'pending',
+                owner TEXT,
+                lease_expires REAL,
+                claims INTEGER NOT NULL DEFAULT 0
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS shards_state ON shards (state, lease_expires)')
+
+    def _transaction(self, fn):
+        # BEGIN IMMEDIATE takes the write lock up front, so two workers can
+        # never both see the same shard as claimable
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                result = fn()
+            except BaseException:
+                self._conn.execute('ROLLBACK')
+                raise
+            self._conn.execute('COMMIT')
+            return result
+
+    def seed(self, start, end, chunk_size):
+        chunk_size = max(1, chunk_size)
+
+        def insert():
+            if self._conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0]:
+                return 0
+            self._conn.executemany(
+                'INSERT INTO shards (start, end) VALUES (?, ?)',
+                [(s, min(s + chunk_size, end)) for s in range(start, end, chunk_size)])
+            return self._conn.execute('SELECT COUNT(*) FROM shards').fetchone()[0]
+
+        created = self._transaction(insert)
+        if created:
+            self.logger.info(f"Seeded shard queue {self.path} with {created} shards over [{start}, {end})")
+        return created
+
+    def claim(self, owner):
+        def take():
+            now = time.time()
+            # Shards whose worker stopped renewing are retried, up to max_claims
+            # times, after which they are parked as failed
+            failed = self._conn.execute("""
+                UPDATE shards SET state = 'failed', owner = NULL
+                WHERE state = 'leased' AND lease_expires < ? AND claims >= ?
+            """, (now, self.max_claims)).rowcount
+            if failed:
+                self.logger.warning(f"Gave up on {failed} shard(s) after {self.max_claims} expired leases")
+            row = self._conn.execute("""
+                SELECT id, start, end, claims FROM shards
+                WHERE state = 'pending' OR (state = 'leased' AND lease_expires < ?)
+                ORDER BY id LIMIT 1
+            """, (now,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("""
+                UPDATE shards SET state = 'leased', owner = ?, lease_expires = ?, claims = claims + 1
+                WHERE id = ?
+            """, (owner, now + self.lease_seconds, row[0]))
+            return Shard(row[0], row[1], row[2], row[3] + 1)
+
+        return self._transaction(take)
+
+    def renew(self, shard, owner):
+        return self._transaction(lambda: self._conn.execute("""
+            UPDATE shards SET lease_expires = ?
+            WHERE id = ? AND owner = ? AND state = 'leased'
+        """, (time.time() + self.lease_seconds, shard.id, owner)).rowcount == 1)
+
+    def complete(self, shard, owner):
+        done = self._transaction(lambda: self._conn.execute("""
+            UPDATE shards SET state = 'done', lease_expires = NULL
+            WHERE id = ? AND owner = ? AND state = 'leased'
+        """, (shard.id, owner)).rowcount == 1)
+        if not done:
+            self.logger.warning(f"Shard {shard.id} was reclaimed before {owner} finished it")
+        return done
+
+    def release(self, shard, owner):
+        return self._transaction(lambda: self._conn.execute("""
+            UPDATE shards SET state = 'pending', owner = NULL, lease_expires = NULL
+            WHERE id = ? AND owner = ? AND state = 'leased'
+        """, (shard.id, owner)).rowcount == 1)
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute('SELECT state, COUNT(*) FROM shards GROUP BY state').fetchall()
+        return dict(rows)
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class LeaseKeeper:
+    """Background thread renewing a shard lease until the work on it is finished"""
+
+    def __init__(self, queue, shard, owner, interval, logger=None):
+        self.queue = queue
+        self.shard = shard
+        self.owner = owner
+        self.interval = interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f'lease-{shard.id}', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.renew(self.shard, self.owner):
+                    self.lost = True
+                    self.logger.warning(f"Lost the lease on shard {self.shard.id}")
+                    return
+            except sqlite3.Error as e:
+                self.logger.warning(f"Could not renew lease on shard {self.shard.id}: {e}")
+
+    def check(self):
+        """Raise LeaseLost once the lease could not be renewed"""
+        if self.lost:
+            raise LeaseLost(f"Lost the lease on shard {self.shard.id}")
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+
+
+def open_shard_queue(spec, lease_seconds=300, max_claims=3, logger=None):
+    """Open a shard queue from a `backend:location` spec; a bare path means SQLite"""
+    backend, sep, location = spec.partition(':')
+    if not sep or len(backend) == 1:
+        # No scheme, or a Windows drive letter
+        backend, location = 'sqlite', spec
+    if backend == 'sqlite':
+        return SQLiteShardQueue(location, lease_seconds, max_claims, logger)
+    raise ValueError(f"Unknown shard queue backend: {backend}")
@@ -0,0 +1,113 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+FIXTURES_DIR = Path(__file__).parent / 'fixtures' / 'pages'
+
+
+def load_corpus(fixtures_dir=FIXTURES_DIR):
+    """Fixture pages in manifest order, as (name, html bytes) pairs"""
+    fixtures_dir = Path(fixtures_dir)
+    with open(fixtures_dir / 'manifest.json') as f:
+        manifest = json.load(f)
+    return [(name, (fixtures_dir / name).read_bytes()) for name in manifest]
+
+
+def fixture_for(media_id, corpus):
+    """Deterministically map a media ID onto the corpus"""
+    return corpus[media_id % len(corpus)]
+
+
+class StandinHandler(BaseHTTPRequestHandler):
+    """Serve /concern/media/<id> from the fixture corpus with injected latency and failures
+
+    Pages carry an ETag of their content and answer a matching
+    If-None-Match with 304, like the production site's conditional GETs.
+    """
+
+    def do_GET(self):
+        config = self.server.config
+        rng = self.server.rng
+        media_id = self.path.rstrip('/').split('/')[-1].split('?')[0]
+        with self.server.lock:
+            delay = max(0.0, rng.gauss(config['latency'], config['jitter']))
+            roll = rng.random()
+        time.sleep(delay)
+
+        if roll < config['throttle_rate']:
+            self.send_error_page(429, {'Retry-After': '1'})
+            return
+        if roll < config['throttle_rate'] + config['failure_rate']:
+            self.send_error_page(503)
+            return
+        if not media_id.isdigit():
+            self.send_error_page(404)
+            return
+
+        _, body = fixture_for(int(media_id), self.server.corpus)
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        if self.headers.get('If-None-Match') == etag:
+            self.send_error_page(304, {'ETag': etag})
+            return
+        self.send_response(200)
+        self.send_header('ETag', etag)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_page(self, status, headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if status != 304:
+            self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_server(port=0, latency=0.0, jitter=0.0, failure_rate=0.0, throttle_rate=0.0, seed=0,
+                 fixtures_dir=FIXTURES_DIR):
+    """Start the stand-in server on a background thread and return it"""
+    server = ThreadingHTTPServer(('127.0.0.1', port), StandinHandler)
+    server.daemon_threads = True
+    server.corpus = load_corpus(fixtures_dir)
+    server.config = {
+        'latency': latency,
+        'jitter': jitter,
+        'failure_rate': failure_rate,
+        'throttle_rate': throttle_rate,
+    }
+    server.rng = random.Random(seed)
+    server.lock = threading.Lock()
+    threading.Thread(target=server.serve_forever, name='standin-server', daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve recorded MorphoSource pages locally')
+    parser.add_argument('--port', type=int, default=0, help='Port to listen on (0 picks a free one)')
+    parser.add_argument('--latency', type=float, default=0.0, help='Mean response delay in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='Standard deviation of the response delay')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='Fraction of requests answered with 503')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='Fraction of requests answered with 429')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    server = start_server(args.port, args.latency, args.jitter, args.failure_rate, args.throttle_rate, args.seed)
+    # The first line tells a parent process where to connect
+    print(f'http://127.0.0.1:{server.server_address[1]}', flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
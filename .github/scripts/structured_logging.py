@@ -0,0 +1,123 @@
+import atexit
+import json
+import logging
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+
+# LogRecord attributes that are not `extra=` fields
+STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, carrying any `extra=` fields of the call"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'thread': record.threadName,
+            'msg': record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items()
+                      if k not in STANDARD_ATTRIBUTES and not k.startswith('_')})
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exc'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class TracebackFilter(logging.Filter):
+    """Keep the first `limit` tracebacks per exception site in each `window` seconds.
+
+    Later records from the same site still get through, but without their
+    traceback and with a `repeats` count, so a failure hitting every page
+    of a batch logs one traceback instead of one per page.
+    """
+
+    def __init__(self, limit=3, window=300.0):
+        super().__init__()
+        self.limit = limit
+        self.window = window
+        self.suppressed = 0
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if not record.exc_info or record.exc_info[0] is None or getattr(record, '_traceback_seen', False):
+            return True
+        # The same filter may sit on several handlers; count each record once
+        record._traceback_seen = True
+        exc_type, _, tb = record.exc_info
+        while tb is not None and tb.tb_next is not None:
+            tb = tb.tb_next
+        site = (exc_type, tb.tb_frame.f_code.co_filename, tb.tb_lineno) if tb is not None else (exc_type,)
+        now = time.monotonic()
+        with self._lock:
+            first, count = self._seen.get(site, (now, 0))
+            if now - first > self.window:
+                first, count = now, 0
+            self._seen[site] = (first, count + 1)
+            if count < self.limit:
+                return True
+            self.suppressed += 1
+        record.exc_info = None
+        record.exc_text = None
+        record.repeats = count + 1
+        record.msg = f"{record.msg} [traceback suppressed, seen {count + 1} times]"
+        return True
+
+
+class DeferredQueueHandler(QueueHandler):
+    """QueueHandler that leaves message formatting to the listener thread.
+
+    The stock handler formats every record on the calling thread. Here only
+    tracebacks are rendered before enqueueing (they reference live frames);
+    %-style arguments are merged on the listener, so the caller pays for a
+    record object and a queue put. Arguments must not be mutated after the
+    call, which holds for the strings and numbers the processor logs.
+    """
+
+    def prepare(self, record):
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def setup_logging(log_file, level=logging.INFO, json_format=False, background=True, name=None):
+    """Log to log_file and the console, through a background writer thread by default
+
+    json_format writes JSON lines to the file (the console stays plain
+    text). Repeated tracebacks are thinned by a TracebackFilter either way.
+    """
+    file_handler = logging.FileHandler(log_file)
+    file_handler.setFormatter(JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT))
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [file_handler, console_handler]
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.setLevel(level)
+    tracebacks = TracebackFilter()
+    if background:
+        queue_handler = DeferredQueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(tracebacks)
+        listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        listener.start()
+        # Drain the queue on exit, including SystemExit raised from SIGTERM
+        atexit.register(listener.stop)
+        root.addHandler(queue_handler)
+    else:
+        for handler in handlers:
+            handler.addFilter(tracebacks)
+            root.addHandler(handler)
+    return logging.getLogger(name)
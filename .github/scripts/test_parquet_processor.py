@@ -2,31 +2,28 @@ import os
 import json
 import logging
 import argparse
-import pandas as pd
 from pathlib import Path
 from datetime import datetime
-from tqdm import tqdm
 import time
-from selenium import webdriver
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import TimeoutException, WebDriverException
+from lxml import html as lxml_html
 import signal
+import socket
 import functools
-
-def setup_logging(log_file):
-    """Configure logging"""
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(levelname)s - %(message)s',
-        handlers=[
-            logging.FileHandler(log_file),
-            logging.StreamHandler()
-        ]
-    )
-    return logging.getLogger(__name__)
+import uuid
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from client_pool import ClientPool
+from result_cache import VOLATILE_COLUMNS, ResultCache, content_hash
+from instrumentation import metrics
+from profiling import profiler
+from structured_logging import setup_logging
+from shard_queue import LeaseKeeper, LeaseLost, open_shard_queue
+from retry_policy import PERMANENT, RETRYABLE, RetryScheduler, classify_error, is_client_fatal, is_timeout
+from morphosource_layout import PAGE_LAYOUTS, field_to_column
+from page_parser import layout_cache, parse_page
+# Selenium, requests, tqdm and the pyarrow-backed writer and URL modules are
+# imported where the chosen engine or writer first needs them, so runs that
+# exit early (no work left, --plan-only) and HTTP runs skip what they never use
 
 def get_latest_data_file():
     """Find the morphosource_data_complete.json file"""
@@ -39,6 +36,9 @@ def get_latest_data_file():
 
 def setup_driver():
     """Configure Chrome driver with optimized settings for testing"""
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
     chrome_options = Options()
     chrome_options.add_argument('--headless')
     chrome_options.add_argument('--no-sandbox')
@@ -76,147 +76,63 @@ def setup_driver():
     
     return driver
 
-def get_fields_for_type(media_type):
-    """Get relevant fields based on media type"""
-    base_fields = {
-        'GENERAL DETAILS': [
-            'Media ID', 'Media type', 'Object element or part',
-            'Object represented', 'Object taxonomy', 'Object organization',
-            'Side', 'Orientation', 'Short description', 'Full description',
-            'Creator', 'Date created', 'Date uploaded'
-        ],
-        'OWNERSHIP AND PERMISSIONS': [
-            'Data managed by', 'Data uploaded by', 'Publication status',
-            'Download reviewer', 'IP holder', 'Copyright statement',
-            'Creative Commons license', 'Morphosource use agreement type',
-            'Permits commercial use', 'Permits 3D use',
-            'Required archival of published derivatives', 'Funding attribution',
-            'Publisher', 'Cite as', 'Media preview mode',
-            'Additional usage agreement'
-        ],
-        'IDENTIFIERS AND EXTERNAL LINKS': [
-            'MorphoSource ARK', 'MorphoSource DOI', 
-            'External identifier', 'External media URL'
-        ]
-    }
-    
-    if media_type.lower() == 'volumetric image series':
-        base_fields.update({
-            'FILE OBJECT DETAILS': [
-                'File name', 'File format(s)', 'File size', 'Image width',
-                'Image height', 'Color space', 'Color depth', 'Compression',
-                'X pixel spacing', 'Y pixel spacing', 'Z pixel spacing',
-                'Pixel spacing units', 'Slice thickness', 'Number of images in set'
-            ],
-            'IMAGE ACQUISITION AND PROCESSING AT A GLANCE': [
-                'Number of parent media', 'Number of processing events', 
-                'Modality', 'Device'
-            ]
-        })
-    elif media_type.lower() == 'mesh':
-        base_fields.update({
-            'FILE OBJECT DETAILS': [
-                'File name', 'File format(s)', 'File size',
-                'Points', 'Polygons', 'Map type', 'UV coordinates',
-                'Vertex color', 'Bounding box dimensions', 
-                'Centroid coordinates', 'Units of point coordinates'
-            ],
-            'IMAGE ACQUISITION AND PROCESSING AT A GLANCE': [
-                'Number of parent media', 'Number of processing events',
-                'Derived directly from', 'Modality', 'Device'
-            ]
-        })
+# Stops the page load once the initial HTML is in
+STOP_LOAD_SCRIPT = """
+window.stop();
+document.body.style.display = 'block';
+"""
+
+def load_page(driver, url):
+    """Navigate a driver to a page and return its HTML"""
+    # Set page load strategy to eager
+    driver.execute_cdp_cmd('Page.setLifecycleEventsEnabled', {'enabled': True})
+    driver.execute_cdp_cmd('Network.setBypassServiceWorker', {'bypass': True})
     
-    return base_fields
+    with metrics.stage('navigation'):
+        driver.get(url)
+        
+        # Execute stop load immediately
+        driver.execute_script(STOP_LOAD_SCRIPT)
+        return driver.page_source
 
 def check_page_structure(driver, url, logger):
     """Analyze page structure with focus on metadata"""
     try:
-        # Set script to stop page load after initial HTML
-        stop_load_script = """
-        window.stop();
-        document.body.style.display = 'block';
-        """
-        
-        # Set page load strategy to eager
-        driver.execute_cdp_cmd('Page.setLifecycleEventsEnabled', {'enabled': True})
-        driver.execute_cdp_cmd('Network.setBypassServiceWorker', {'bypass': True})
-        
-        driver.get(url)
-        
-        # Execute stop load immediately
-        driver.execute_script(stop_load_script)
-        
-        # Quick check for title with shorter timeout
-        WebDriverWait(driver, 3).until(lambda d: d.title)
-        
-        if "Showcase Media" not in driver.title:
-            return None, "Not a valid MorphoSource media page"
-        
-        # Single attempt to find content with shorter timeout
-        try:
-            WebDriverWait(driver, 5).until(lambda d: (
-                d.find_elements(By.CLASS_NAME, "showcase-label") or 
-                d.find_elements(By.CLASS_NAME, "field-name")
-            ))
-        except TimeoutException:
-            return None, "Content not found quickly enough"
+        page_html = load_page(driver, url)
         
-        # Try different layout patterns
-        layouts = {
-            'showcase': {
-                'media_type_xpath': "//div[contains(@class, 'showcase-label')][contains(text(), 'Media type')]/following-sibling::div[contains(@class, 'showcase-value')]",
-                'field_class': 'showcase-label',
-                'value_class': 'showcase-value'
-            },
-            'traditional': {
-                'media_type_xpath': "//div[@class='field-name'][contains(text(), 'Media type')]/following-sibling::div[@class='field-value']",
-                'field_class': 'field-name',
-                'value_class': 'field-value'
-            }
-        }
-        
-        # Detect layout type and media type with retries
-        layout_used = None
-        media_type = None
-        
-        for layout_name, selectors in layouts.items():
-            try:
-                # Wait for media type element with timeout
-                elem = WebDriverWait(driver, 10).until(
-                    EC.presence_of_element_located((By.XPATH, selectors['media_type_xpath']))
-                )
-                if elem:
-                    media_type = elem.text.strip()
-                    layout_used = layout_name
-                    logger.info(f"Found media type using {layout_name} layout")
-                    break
-            except:
-                continue
-                
-        if not layout_used or not media_type:
-            return None, "Could not determine page layout or media type"
+        with metrics.stage('layout'):
+            # driver.get has already waited for the load event, so classify
+            # the DOM as it stands instead of polling for each layout
+            tree = lxml_html.fromstring(page_html)
+            title = tree.findtext('.//title') or ''
+            if "Showcase Media" not in title:
+                return None, "Not a valid MorphoSource media page"
             
-        logger.info(f"Detected Layout: {layout_used}")
-        logger.info(f"Media Type: {media_type}")
-        
-        # Get fields for type
-        sections = get_fields_for_type(media_type)
+            layout_used, media_type = layout_cache.classify(tree, url)
+            if not layout_used:
+                return None, "Could not determine page layout or media type"
             
-        # Return configuration
-        return {
-            'layout': layout_used,
-            'media_type': media_type,
-            'selectors': layouts[layout_used],
-            'sections': sections
-        }, None
+            logger.debug("Detected layout %s, media type %s for %s", layout_used, media_type, url)
+            
+            # Return configuration, with the parsed tree for single-pass extraction
+            return {
+                'layout': layout_used,
+                'media_type': media_type,
+                'selectors': PAGE_LAYOUTS[layout_used],
+                'sections': layout_cache.fields_for(media_type),
+                'tree': tree
+            }, None
         
     except Exception as e:
         logger.error(f"Error analyzing page structure: {str(e)}", exc_info=True)
         return None, f"Error analyzing page structure: {str(e)}"
 
 def extract_page_data(driver, url, logger):
-    """Extract structured data with optimized timing"""
+    """Per-field extraction: one XPath query on the live driver per field
+
+    Single-pass mode never gets here; its pages are parsed from the HTML
+    returned by fetch_page_source.
+    """
     data = {
         'url': url,
         'processed_at': datetime.now().isoformat(),
@@ -234,29 +150,23 @@ def extract_page_data(driver, url, logger):
             logger.error(f"Error: {error}")
             data['error'] = error
             return data
-            
-        for section_name, fields in config['sections'].items():
-            if time.time() - start_time > extraction_timeout:
-                logger.warning("Extraction timeout reached")
-                break
+        
+        from selenium.webdriver.common.by import By
+        with metrics.stage('extraction'):
+            for section_name, fields in config['sections'].items():
+                if time.time() - start_time > extraction_timeout:
+                    logger.warning("Extraction timeout reached")
+                    break
                 
-            for field in fields:
-                try:
-                    # Use faster XPath queries
-                    if config['layout'] == 'showcase':
-                        value_elem = driver.find_element(By.XPATH, 
-                            f"//div[contains(@class, 'showcase-label')][contains(text(), '{field}')]/following-sibling::div[1]")
-                    else:
-                        value_elem = driver.find_element(By.XPATH,
-                            f"//div[@class='field-name'][contains(text(), '{field}')]/following-sibling::div[1]")
+                for field in fields:
+                    try:
+                        value_elem = driver.find_element(By.XPATH, config['selectors']['field_xpath'].format(field=field))
                     
-                    if value_elem:
-                        value = value_elem.text.strip().split('\n')[0]
-                        column_name = field.lower().replace(' ', '_').replace('(', '').replace(')', '')
-                        data[column_name] = value
-                except:
-                    column_name = field.lower().replace(' ', '_').replace('(', '').replace(')', '')
-                    data[column_name] = None
+                        if value_elem:
+                            value = value_elem.text.strip().split('\n')[0]
+                            data[field_to_column(field)] = value
+                    except:
+                        data[field_to_column(field)] = None
         
         return data
         
@@ -265,171 +175,689 @@ def extract_page_data(driver, url, logger):
         data['error'] = str(e)
         return data
 
-def process_url_batch(urls, output_dir, logger, start_index, total_processed, max_records, output_file=None):
-    """Process a batch of URLs and save to parquet"""
-    all_data = []
-    processed_count = 0
-    error_count = 0
-    skipped_records = []
-    retry_count = 2  # Reduced from 3 to 2 retries
-    record_timeout = 10  # Reduced from 120 to 10 seconds timeout per record
+def create_client(engine):
+    """Create the page client for an extraction engine"""
+    if engine == 'http':
+        import http_engine
+        return http_engine.create_session()
+    return setup_driver()
+
+def close_client(client):
+    """Release a page client, ignoring shutdown errors"""
+    try:
+        if hasattr(client, 'quit'):
+            client.quit()
+        else:
+            client.close()
+    except:
+        pass
+
+def driver_is_healthy(driver):
+    """Cheap round trip to check a driver's session is still alive"""
+    try:
+        return driver.execute_script('return 1') == 1
+    except Exception:
+        return False
+
+def driver_rss_mb(driver):
+    """Memory used by a driver's chromedriver and Chrome processes"""
+    from driver_manager import process_tree_rss_mb
+    process = getattr(getattr(driver, 'service', None), 'process', None)
+    return process_tree_rss_mb(process.pid if process is not None else None)
+
+def create_pool(engine, workers, logger, error_threshold=3, warm_drivers=1, driver_max_pages=200,
+                driver_max_rss_mb=1500):
+    """Pool of page clients for an engine; Chrome drivers get the lifecycle manager"""
+    if engine == 'http':
+        # Load requests here rather than inside the first timed fetches on the workers
+        import http_engine
+    if engine == 'selenium':
+        from driver_manager import DriverManager
+        return DriverManager(
+            lambda: create_client(engine),
+            close_client,
+            size=workers,
+            logger=logger,
+            error_threshold=error_threshold,
+            warm=warm_drivers,
+            max_pages=driver_max_pages,
+            max_rss_mb=driver_max_rss_mb,
+            health_check=driver_is_healthy,
+            rss_probe=driver_rss_mb
+        )
+    return ClientPool(lambda: create_client(engine), close_client, size=workers, logger=logger,
+                      error_threshold=error_threshold)
+
+def fetch_page_source(engine, client, url, validators=None):
+    """Load a page with the chosen engine and return (html, HTTP validators)
+
+    The HTTP engine sends a conditional request when validators are given
+    and returns None for the HTML when the page is unchanged. Chrome gives
+    no access to response headers, so the selenium engine always loads the
+    page and returns no validators.
+    """
+    if engine == 'http':
+        import http_engine
+        with metrics.stage('navigation'):
+            return http_engine.fetch_page_conditional(client, url, validators)
+    return load_page(client, url), None
+
+def fetch_url(url, pool, engine, logger, extract_mode='single-pass', attempt=1,
+              prior_errors=0, prior_time=0.0, validators=None):
+    """Fetch stage: make one attempt at loading a page and hand back its HTML
+
+    The client goes back to the pool as soon as the page is read, so parsing
+    never holds a driver. Per-field extraction needs the live DOM, so in that
+    mode the record is finished here instead.
+    """
+    fetched = {'url': url, 'html': None, 'data': None, 'errors': prior_errors, 'attempts': attempt,
+               'error': None, 'start_time': time.time(), 'prior_time': prior_time,
+               'not_modified': False, 'validators': None}
+    client = None
+    metrics.begin_record()
+    try:
+        with metrics.stage('client'):
+            client = pool.acquire()
+        logger.debug("Processing URL: %s (attempt %d)", url, attempt)
+        if engine == 'selenium' and extract_mode == 'per-field':
+            fetched['data'] = extract_page_data(client, url, logger)
+        else:
+            fetched['html'], fetched['validators'] = fetch_page_source(engine, client, url, validators)
+            fetched['not_modified'] = fetched['html'] is None
+    except Exception as e:
+        logger.error("Error on attempt %d for %s: %s", attempt, url, e, exc_info=True)
+        if client is not None:
+            pool.release(client, failed=True, fatal=is_client_fatal(e))
+        fetched['error'] = e
+        return fetched
+    finally:
+        fetched['stages'] = metrics.end_record()
+    
+    error = fetched['data'].get('error') if fetched['data'] is not None else None
+    pool.release(client, failed=bool(error) and classify_error(error) == RETRYABLE)
+    return fetched
+
+def parse_fetched(fetched, logger):
+    """Parse stage: turn a fetched page into the outcome of its attempt"""
+    url = fetched['url']
+    outcome = {'url': url, 'data': None, 'errors': fetched['errors'], 'attempts': fetched['attempts'],
+               'error': fetched['error'], 'unchanged': fetched['not_modified'], 'validators': fetched['validators']}
+    page_data = fetched['data']
+    stages = fetched['stages']
+    if fetched['html'] is not None:
+        metrics.begin_record()
+        try:
+            page_data = parse_page(fetched['html'], url, logger)
+        except Exception as e:
+            # e.g. an empty document; treat it like a failed fetch
+            logger.error(f"Error parsing {url}: {str(e)}")
+            outcome['errors'] += 1
+            outcome['error'] = e
+        finally:
+            parse_stages = metrics.end_record()
+        stages = dict(stages)
+        stages.update({k: v for k, v in parse_stages.items() if v is not None})
+    
+    outcome['processing_time'] = fetched['prior_time'] + time.time() - fetched['start_time']
+    if page_data is None:
+        return outcome
+    
+    page_data.update(stages)
+    error = page_data.get('error')
+    if error:
+        logger.warning(f"Data extracted with error: {error}")
+        outcome['errors'] += 1
+        outcome['error'] = error
+        return outcome
+    
+    page_data['attempt'] = fetched['attempts']
+    page_data['processing_time'] = outcome['processing_time']
+    outcome['data'] = page_data
+    return outcome
+
+def recently_checked(cache, url, max_age):
+    """Whether a cached URL was fetched or confirmed unchanged within max_age seconds"""
+    if max_age is None:
+        return False
+    entry = cache.entry(url)
+    return entry is not None and time.time() - entry.fetched_at <= max_age
+
+def process_url(url, pool, engine, logger, extract_mode='single-pass', attempt=1,
+                prior_errors=0, prior_time=0.0, validators=None):
+    """Make one extraction attempt for a URL and report how it went
+
+    Retries are not made here; failed outcomes go back to the caller, which
+    decides from the error whether to defer the URL or give up on it.
+    """
+    return parse_fetched(
+        fetch_url(url, pool, engine, logger, extract_mode, attempt, prior_errors, prior_time, validators), logger)
+
+def copy_future(source, target):
+    """Resolve `target` the way `source` resolved"""
+    if source.cancelled():
+        target.cancel()
+    elif source.exception() is not None:
+        target.set_exception(source.exception())
+    else:
+        target.set_result(source.result())
+
+def then(future, executor, fn, *args):
+    """Future for fn(future.result(), *args), run on `executor` once `future` completes"""
+    chained = Future()
+    
+    def submit(done):
+        if done.cancelled() or done.exception() is not None:
+            copy_future(done, chained)
+            return
+        try:
+            executor.submit(fn, done.result(), *args).add_done_callback(lambda f: copy_future(f, chained))
+        except RuntimeError as e:
+            # The executor was shut down while the batch was being torn down
+            chained.set_exception(e)
+    
+    future.add_done_callback(submit)
+    return chained
+
+class BatchResults:
+    """In-order bookkeeping for a batch: batch_index assignment, parquet writes and skipped records
+
+    With refresh=True only records whose content hash differs from the cached
+    one are written, and every addition, change or removal is appended to a
+    delta file in output_dir. With a shard `lease`, record() raises LeaseLost
+    instead of writing once the lease has been lost.
+    """
+
+    def __init__(self, sink, output_dir, start_index, logger, cache=None, refresh=False, lease=None):
+        self.sink = sink
+        self.lease = lease
+        self.cache = cache
+        self.output_dir = output_dir
+        self.start_index = start_index
+        self.logger = logger
+        self.refresh = refresh
+        self.processed_count = 0
+        self.unchanged_count = 0
+        self.error_count = 0
+        self.skipped_records = []
+        self.delta_file = None
+        self.start_time = time.time()
+
+    def record(self, outcome):
+        """Record the outcome of one URL; outcomes must arrive in input order"""
+        if self.lease is not None:
+            self.lease.check()
+        url = outcome['url']
+        current_index = self.start_index + self.processed_count
+        self.error_count += outcome['errors']
+        
+        if outcome.get('unchanged'):
+            self.mark_unchanged(url, outcome.get('validators'), confirmed=not outcome.get('cached'))
+            return
+        
+        if outcome['data'] is not None:
+            page_data = outcome['data']
+            if self.refresh and not self.record_change(page_data, current_index):
+                self.mark_unchanged(url, outcome.get('validators'))
+                return
+            page_data['batch_index'] = current_index
+            self.sink.write(page_data)
+            if self.cache is not None and not outcome.get('cached'):
+                self.cache.put(page_data, outcome.get('validators'))
+            self.processed_count += 1
+            metrics.count('records_written')
+            self.logger.debug("Successfully processed %s (record %d)", url, current_index)
+            return
+        
+        if self.refresh and outcome['reason'] == 'permanent' and self.cache.entry(url) is not None:
+            # A page that used to extract and now cannot is gone from the catalog
+            self.write_delta({'url': url, 'change': 'removed', 'batch_index': None,
+                              'error': str(outcome['error'])})
+            self.cache.delete(url)
+        
+        metrics.count('records_skipped')
+        self.skipped_records.append({
+            'url': url,
+            'index': current_index,
+            'reason': outcome['reason'],
+            'error': str(outcome['error']) if outcome.get('error') is not None else None,
+            'processing_time': outcome['processing_time'],
+            'attempts': outcome['attempts']
+        })
+        if outcome['reason'] == 'timeout':
+            # Save skipped record immediately
+            skipped_file = self.output_dir / f'skipped_records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
+            with open(skipped_file, 'w') as f:
+                json.dump([self.skipped_records[-1]], f, indent=2)
+            self.logger.info(f"Saved skipped record to {skipped_file}")
+
+    def mark_unchanged(self, url, validators=None, confirmed=True):
+        if confirmed:
+            self.cache.touch(url, validators)
+        self.unchanged_count += 1
+        metrics.count('records_unchanged')
+        self.logger.debug("Unchanged since last crawl: %s", url)
+
+    def record_change(self, page_data, batch_index):
+        """Compare a refreshed record with its cached fingerprint; log it to the delta file if it changed"""
+        url = page_data['url']
+        entry = self.cache.entry(url)
+        new_hash = content_hash(page_data)
+        if entry is not None and entry.content_hash == new_hash:
+            return False
+        change = {'url': url, 'change': 'added', 'batch_index': batch_index, 'content_hash': new_hash}
+        if entry is not None:
+            previous = self.cache.get(url) or {}
+            change['change'] = 'changed'
+            change['previous_hash'] = entry.content_hash
+            change['changed_fields'] = sorted(
+                k for k in set(previous) | set(page_data)
+                if k not in VOLATILE_COLUMNS and previous.get(k) != page_data.get(k))
+        self.write_delta(change)
+        return True
+
+    def write_delta(self, change):
+        """Append one change to this batch's delta file (JSON lines)"""
+        if self.delta_file is None:
+            self.delta_file = self.output_dir / f'delta_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{self.start_index}.jsonl'
+        change['detected_at'] = datetime.now().isoformat()
+        with open(self.delta_file, 'a') as f:
+            f.write(json.dumps(change, default=str) + '\n')
+        metrics.count(f"records_{change['change']}")
+
+    def write_skipped(self):
+        """Save every URL this batch gave up on, so later planning can leave permanent failures out"""
+        if not self.skipped_records:
+            return
+        skipped_file = self.output_dir / f'skipped_records_{datetime.now().strftime("%Y%m%d_%H%M%S")}_{self.start_index}.json'
+        with open(skipped_file, 'w') as f:
+            json.dump(self.skipped_records, f, indent=2)
+        self.logger.info(f"Saved {len(self.skipped_records)} skipped record(s) to {skipped_file}")
+
+    def write_outputs(self, output_file, end_index, total_urls, total_processed):
+        """Append the batch summary to the GitHub Actions output file"""
+        with open(output_file, 'a') as f:
+            has_more = end_index < total_urls
+            f.write(f"has_more={str(has_more).lower()}\n")
+            f.write(f"next_index={end_index}\n")
+            f.write(f"total_processed={total_processed + self.processed_count + self.unchanged_count}\n")
+            f.write(f"unchanged_count={self.unchanged_count}\n")
+            f.write(f"error_count={self.error_count}\n")
+            f.write(f"skipped_count={len(self.skipped_records)}\n")
+            f.write(f"elapsed_seconds={time.time() - self.start_time:.1f}\n")
+
+def create_sink(output_dir, logger, flush_rows=100, flush_bytes=16 * 1024 * 1024, compression='zstd',
+                suffix=None, dataset_dir=None):
+    """Open the parquet sink for this run: one file in output_dir, or new parts of a partitioned dataset"""
+    from parquet_sink import ParquetSink, PartitionedParquetSink
+    from record_schema import build_record_schema, coerce_record, coercion_failures, record_partition
     
+    def on_flush(sink):
+        coercion_failures.report(logger)
+        if profiler.enabled:
+            profiler.on_flush(sink)
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    options = dict(
+        flush_rows=flush_rows,
+        flush_bytes=flush_bytes,
+        compression=compression,
+        coerce=coerce_record,
+        logger=logger,
+        background=True,
+        on_flush=on_flush
+    )
+    schema = build_record_schema(stage_timings=metrics.enabled)
+    if dataset_dir:
+        run_id = f'{timestamp}_{suffix or uuid.uuid4().hex[:8]}'
+        return PartitionedParquetSink(Path(dataset_dir), schema, record_partition, run_id, **options)
+    name = f'morphosource_data_{timestamp}_{suffix}' if suffix else f'morphosource_data_{timestamp}'
+    return ParquetSink(output_dir / f'{name}.parquet', schema, **options)
+
+def close_sink(sink, logger):
+    """Close a sink from create_sink, then log coercion failures the last flush left unreported
+
+    With a background writer, a flush's records are coerced after its flush
+    hook has run, so the last row group's failures only show up here.
+    """
+    from record_schema import coercion_failures
+    try:
+        sink.close()
+    finally:
+        coercion_failures.report(logger)
+
+def process_url_batch(urls, output_dir, logger, start_index, total_processed, max_records, output_file=None,
+                      flush_rows=100, flush_bytes=16 * 1024 * 1024, engine='selenium',
+                      extract_mode='single-pass', workers=1, cache=None, resume=False, max_age=None,
+                      max_attempts=2, retry_base_delay=1.0, retry_max_delay=30.0, error_threshold=3,
+                      compression='zstd', sink=None, warm_drivers=1, driver_max_pages=200,
+                      driver_max_rss_mb=1500, parse_workers=1, dataset_dir=None, refresh=False, pool=None,
+                      lease=None):
+    """Process a batch of URLs and append them to a single parquet file
+
+    Each URL runs through a fetch -> parse -> serialize/write pipeline: `workers`
+    threads load pages, `parse_workers` threads parse them, and the sink's
+    writer thread converts and writes row groups. Outcomes are consumed in
+    input order from a bounded window, so memory stays flat however large
+    the batch is. Records go to `sink` when one is passed (the caller then
+    owns closing it), otherwise to a new file in output_dir, or to new parts of
+    the partitioned dataset at dataset_dir when that is given. Likewise pages
+    are fetched with `pool` when one is passed, otherwise with a new pool
+    closed at the end of the batch. With a shard `lease`, the batch stops
+    with LeaseLost as soon as the lease is lost.
+
+    With a result cache and resume=True, URLs already cached (and younger than
+    max_age seconds, if given) are written from the cache instead of fetched.
+    URLs failing with a retryable error are deferred with jittered backoff and
+    retried after the main pass, up to max_attempts attempts in total.
+
+    With a result cache and refresh=True, only new or changed records are
+    written. Cached URLs confirmed within max_age seconds are not fetched at
+    all, the HTTP engine revalidates the rest with conditional requests, and
+    pages that do come back are compared with their cached fingerprint.
+    """
     # Calculate the correct start and end indices
     end_index = min(start_index + max_records, len(urls))
     batch_urls = urls[start_index:end_index]
     
-    logger.info(f"Processing batch from index {start_index} to {end_index} (total processed so far: {total_processed})")
+    logger.info(f"Processing batch from index {start_index} to {end_index} with {workers} worker(s) "
+                f"(total processed so far: {total_processed})")
+    
+    own_sink = sink is None
+    if own_sink:
+        sink = create_sink(output_dir, logger, flush_rows, flush_bytes, compression, dataset_dir=dataset_dir)
+    results = BatchResults(sink, output_dir, start_index, logger, cache, refresh, lease)
+    scheduler = RetryScheduler(max_attempts, retry_base_delay, retry_max_delay)
+    own_pool = pool is None
+    if own_pool:
+        pool = create_pool(engine, workers, logger, error_threshold, warm_drivers, driver_max_pages,
+                           driver_max_rss_mb)
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='worker')
+    parse_executor = ThreadPoolExecutor(max_workers=max(1, parse_workers), thread_name_prefix='parser')
+    
+    # Keep a bounded window of URLs in flight and consume results in input
+    # order, so batch_index stays sequential and only this thread writes
+    window = workers * 2 + max(1, parse_workers)
+    pending = deque()
+    url_iter = iter(batch_urls)
+    
+    def submit_url(url, attempt=1, prior_errors=0, prior_time=0.0):
+        # Cache lookups stay on this thread; the SQLite connection is not shared
+        entry = cache.entry(url) if refresh else None
+        validators = {'etag': entry.etag, 'last_modified': entry.last_modified} if entry is not None else None
+        fetched = executor.submit(fetch_url, url, pool, engine, logger, extract_mode, attempt,
+                                  prior_errors, prior_time, validators)
+        return then(fetched, parse_executor, parse_fetched, logger)
+    
+    def submit_next():
+        url = next(url_iter, None)
+        if url is None:
+            return
+        cached = cache.get(url, max_age) if resume and cache is not None else None
+        if cached is not None:
+            future = Future()
+            future.set_result({'url': url, 'data': cached, 'errors': 0, 'attempts': 0,
+                               'processing_time': 0.0, 'cached': True})
+            pending.append(future)
+        elif refresh and recently_checked(cache, url, max_age):
+            future = Future()
+            future.set_result({'url': url, 'data': None, 'errors': 0, 'attempts': 0,
+                               'processing_time': 0.0, 'unchanged': True, 'cached': True})
+            pending.append(future)
+        else:
+            pending.append(submit_url(url))
     
-    driver = None
+    def settle(outcome):
+        if outcome['data'] is None and not outcome.get('unchanged'):
+            error = outcome['error']
+            if classify_error(error) == PERMANENT:
+                outcome['reason'] = 'permanent'
+            elif scheduler.defer(outcome, outcome['attempts']):
+                metrics.count('retries')
+                logger.info("Deferred %s for retry after attempt %d", outcome['url'], outcome['attempts'])
+                return
+            else:
+                outcome['reason'] = 'timeout' if is_timeout(error) else 'max_attempts'
+        results.record(outcome)
     
     try:
-        for url in tqdm(batch_urls, desc=f"Processing URLs {start_index}-{end_index}"):
-            attempts = 0
-            success = False
-            start_time = time.time()
-            
-            current_index = start_index + processed_count
-            logger.info(f"Processing record {current_index} (URL: {url})")
-            
-            while attempts < retry_count and not success and (time.time() - start_time) < record_timeout:
-                try:
-                    if driver is None:
-                        logger.info("Setting up new Chrome driver")
-                        driver = setup_driver()
-                    
-                    logger.info(f"Processing URL: {url} (Attempt {attempts + 1}/{retry_count})")
-                    page_data = extract_page_data(driver, url, logger)
-                    
-                    page_data['batch_index'] = current_index
-                    page_data['attempt'] = attempts + 1
-                    page_data['processing_time'] = time.time() - start_time
-                    
-                    if page_data.get('error'):
-                        logger.warning(f"Data extracted with error: {page_data['error']}")
-                        error_count += 1
-                        attempts += 1
-                        time.sleep(1)  # Reduced from 5s to 1s wait between retries
-                    else:
-                        success = True
-                        logger.info(f"Successfully processed {url} (record {current_index})")
-                        all_data.append(page_data)
-                        processed_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error on attempt {attempts + 1} for {url}: {str(e)}", exc_info=True)
-                    attempts += 1
-                    
-                    # Reset driver on error
-                    if driver is not None:
-                        try:
-                            driver.quit()
-                        except:
-                            pass
-                        driver = None
-                    
-                    if attempts < retry_count:
-                        logger.info(f"Retrying {url} after error...")
-                        time.sleep(1)  # Reduced from 5s to 1s wait
-                
-                # Check timeout outside the try block
-                if (time.time() - start_time) >= record_timeout:
-                    logger.warning(f"Record processing timeout reached for {url}")
-                    if not success:  # Only add to skipped if not already processed
-                        skipped_records.append({
-                            'url': url,
-                            'index': current_index,
-                            'reason': 'timeout',
-                            'processing_time': time.time() - start_time,
-                            'attempts': attempts
-                        })
-                        # Save skipped record immediately
-                        skipped_file = output_dir / f'skipped_records_{datetime.now().strftime("%Y%m%d_%H%M%S")}.json'
-                        with open(skipped_file, 'w') as f:
-                            json.dump([skipped_records[-1]], f, indent=2)
-                        logger.info(f"Saved skipped record to {skipped_file}")
-                    break
-            
-            # Only add to skipped records if truly failed and not already processed
-            if not success and not any(r['url'] == url for r in skipped_records):
-                skipped_records.append({
-                    'url': url,
-                    'index': current_index,
-                    'reason': 'max_attempts',
-                    'processing_time': time.time() - start_time,
-                    'attempts': attempts
-                })
-            
-            # Save intermediate results every 10 records
-            if len(all_data) % 10 == 0 and all_data:
-                save_batch_results(all_data, output_dir, logger)
+        for _ in range(window):
+            submit_next()
+        
+        from tqdm import tqdm
+        progress = tqdm(range(len(batch_urls)), desc=f"Processing URLs {start_index}-{end_index}",
+                        disable=not logger.isEnabledFor(logging.INFO))
+        for _ in progress:
+            outcome = pending.popleft().result()
+            submit_next()
+            settle(outcome)
+        
+        # Drain the deferred retries once the main pass is done
+        while scheduler:
+            ready = scheduler.pop_ready()
+            logger.info(f"Retrying {len(ready)} deferred URL(s), {len(scheduler)} still waiting")
+            futures = [
+                submit_url(o['url'], o['attempts'] + 1, o['errors'], o['processing_time'])
+                for o in ready
+            ]
+            for future in futures:
+                settle(future.result())
                 
     finally:
-        if driver is not None:
-            try:
-                driver.quit()
-            except:
-                pass
-    
-    # Save final results
-    if all_data:
-        save_batch_results(all_data, output_dir, logger)
-        
+        executor.shutdown(wait=False, cancel_futures=True)
+        parse_executor.shutdown(wait=False, cancel_futures=True)
+        if own_pool:
+            pool.close()
+        if own_sink:
+            close_sink(sink, logger)
+        results.write_skipped()
+    
+    logger.info(f"Deferred {scheduler.deferred} retries, recycled {pool.recycled} client(s)")
+    if refresh:
+        logger.info(f"Refresh: {results.processed_count} new or changed, {results.unchanged_count} unchanged"
+                    + (f", delta in {results.delta_file}" if results.delta_file else ""))
+    
+    if results.processed_count or results.unchanged_count:
         # Write outputs to GitHub Actions output file
         if output_file:
-            with open(output_file, 'a') as f:
-                has_more = end_index < len(urls)
-                f.write(f"has_more={str(has_more).lower()}\n")
-                f.write(f"next_index={end_index}\n")
-                f.write(f"total_processed={total_processed + processed_count}\n")
-                f.write(f"error_count={error_count}\n")
-                f.write(f"skipped_count={len(skipped_records)}\n")
+            results.write_outputs(output_file, end_index, len(urls), total_processed)
         
-        return processed_count
+        return results.processed_count + results.unchanged_count
     
     return 0
 
-def save_batch_results(data, output_dir, logger):
-    """Save current batch of results to parquet file"""
+def process_url_batch_async(urls, output_dir, logger, start_index, total_processed, max_records, output_file=None,
+                            flush_rows=100, flush_bytes=16 * 1024 * 1024, concurrency=4,
+                            max_concurrency=32, rate_limit=5.0, cache=None, max_attempts=2,
+                            retry_base_delay=1.0, retry_max_delay=30.0, compression='zstd', sink=None,
+                            dataset_dir=None, refresh=False, max_age=None, lease=None):
+    """Process a batch of URLs with the asyncio crawler; refresh and lease work as in process_url_batch"""
+    import asyncio
+    import async_crawler
+    
+    end_index = min(start_index + max_records, len(urls))
+    batch_urls = urls[start_index:end_index]
+    
+    logger.info(f"Crawling batch from index {start_index} to {end_index} "
+                f"(concurrency {concurrency}-{max_concurrency}, {rate_limit} req/s per host)")
+    
+    own_sink = sink is None
+    if own_sink:
+        sink = create_sink(output_dir, logger, flush_rows, flush_bytes, compression, dataset_dir=dataset_dir)
+    results = BatchResults(sink, output_dir, start_index, logger, cache, refresh, lease)
+    validators_for = None
+    if refresh:
+        # Recently confirmed URLs are not requested at all
+        checked = {url for url in batch_urls if recently_checked(cache, url, max_age)}
+        for url in checked:
+            results.mark_unchanged(url, confirmed=False)
+        batch_urls = [url for url in batch_urls if url not in checked]
+        
+        def validators_for(url):
+            entry = cache.entry(url)
+            return {'etag': entry.etag, 'last_modified': entry.last_modified} if entry is not None else None
     try:
-        df = pd.DataFrame(data)
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        parquet_file = output_dir / f'morphosource_data_{timestamp}.parquet'
-        df.to_parquet(parquet_file, index=False)
-        logger.info(f"Saved {len(data)} records to {parquet_file}")
-        logger.info(f"Columns: {', '.join(df.columns)}")
-    except Exception as e:
-        logger.error(f"Error saving batch results: {e}", exc_info=True)
+        asyncio.run(async_crawler.crawl(
+            batch_urls,
+            results.record,
+            logger,
+            concurrency=concurrency,
+            max_concurrency=max_concurrency,
+            rate_limit=rate_limit,
+            retry_count=max_attempts,
+            retry_base_delay=retry_base_delay,
+            retry_max_delay=retry_max_delay,
+            validators_for=validators_for,
+            # The crawler keeps going past on_outcome errors, so stop it explicitly
+            stop=(lambda: lease.lost) if lease is not None else None
+        ))
+        if lease is not None:
+            lease.check()
+    finally:
+        if own_sink:
+            close_sink(sink, logger)
+        results.write_skipped()
+    
+    if refresh:
+        logger.info(f"Refresh: {results.processed_count} new or changed, {results.unchanged_count} unchanged"
+                    + (f", delta in {results.delta_file}" if results.delta_file else ""))
+    if results.processed_count or results.unchanged_count:
+        if output_file:
+            results.write_outputs(output_file, end_index, len(urls), total_processed)
+        return results.processed_count + results.unchanged_count
+    
+    return 0
+
+def handle_termination(signum, frame):
+    """Turn SIGTERM into SystemExit so the parquet footer is still written"""
+    raise SystemExit(128 + signum)
+
+def report_no_work(output_file, logger, start_index, total_processed, total_to_process):
+    """Log and report a run that has nothing left to process"""
+    logger.info(f"Target number of records already processed: {total_processed} of {total_to_process}")
+    if output_file:
+        with open(output_file, 'a') as f:
+            f.write("has_more=false\n")
+            f.write(f"next_index={start_index}\n")
+            f.write(f"total_processed={total_processed}\n")
+    return 0
 
 def main():
+    signal.signal(signal.SIGTERM, handle_termination)
     parser = argparse.ArgumentParser()
     parser.add_argument('--output-dir', required=True)
-    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--dataset-dir',
+                        help='Write records as new parts of a hive-partitioned dataset here (by media_type and '
+                             'url_bucket, with a manifest per run) instead of one file in --output-dir')
+    parser.add_argument('--batch-size', type=int, default=100,
+                        help='Records buffered per parquet row group')
+    parser.add_argument('--flush-bytes', type=int, default=16 * 1024 * 1024,
+                        help='Flush buffered records once they reach this many bytes')
     parser.add_argument('--max-records', type=int, default=500)
     parser.add_argument('--start-index', type=int, default=0)
     parser.add_argument('--total-processed', type=int, default=0)
     parser.add_argument('--total-target', type=int, default=0)
+    parser.add_argument('--engine', choices=['selenium', 'http', 'async'], default='selenium',
+                        help='Fetch pages with headless Chrome, a plain HTTP session or the asyncio crawler')
+    parser.add_argument('--extract-mode', choices=['single-pass', 'per-field'], default='single-pass',
+                        help='Resolve selenium fields from one DOM pass or one XPath query per field')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Number of pages fetched concurrently, each with its own driver or session')
+    parser.add_argument('--parse-workers', type=int, default=1,
+                        help='Threads parsing fetched pages while the workers fetch the next ones')
+    parser.add_argument('--max-concurrency', type=int, default=32,
+                        help='Upper bound for the async engine\'s adaptive concurrency')
+    parser.add_argument('--rate-limit', type=float, default=5.0,
+                        help='Requests per second per host for the async engine')
+    parser.add_argument('--id-file',
+                        help='Process only these media IDs (.npy or one per line, e.g. from work_catalog.py); '
+                             '--start-index and --max-records then count within this list')
+    parser.add_argument('--build-index', action='store_true',
+                        help='Build the URL index for the data file and exit')
+    parser.add_argument('--plan-only', action='store_true',
+                        help='Work out the range this run would process, report it and exit; the data file '
+                             'is only read when the URL count is needed (no --total-target, or --id-file)')
+    parser.add_argument('--cache-file', help='SQLite result cache shared across runs')
+    parser.add_argument('--resume', action='store_true',
+                        help='Write cached records instead of fetching their URLs again (not with --engine async)')
+    parser.add_argument('--refresh', action='store_true',
+                        help='Revalidate cached URLs (conditional requests with the HTTP engines, content '
+                             'fingerprints otherwise) and write only new or changed records plus a delta file')
+    parser.add_argument('--refresh-older-than', type=float,
+                        help='With --resume, refetch cached records older than this many hours; with --refresh, '
+                             'only revalidate records last confirmed longer ago than this')
+    parser.add_argument('--cache-ttl-hours', type=float, default=30 * 24,
+                        help='Evict cache entries older than this many hours')
+    parser.add_argument('--cache-max-entries', type=int, default=500000,
+                        help='Keep at most this many cache entries')
+    parser.add_argument('--max-attempts', type=int, default=2,
+                        help='Attempts per URL before it is skipped; permanent errors are not retried')
+    parser.add_argument('--retry-base-delay', type=float, default=1.0,
+                        help='Base delay in seconds for exponential retry backoff')
+    parser.add_argument('--retry-max-delay', type=float, default=30.0,
+                        help='Upper bound in seconds for a single retry backoff')
+    parser.add_argument('--driver-error-threshold', type=int, default=3,
+                        help='Consecutive failures before a driver or session is recycled')
+    parser.add_argument('--queue',
+                        help='Shard queue (a SQLite file, or backend:location) to keep claiming URL chunks '
+                             'from until it drains, instead of processing one fixed range')
+    parser.add_argument('--queue-chunk-size', type=int, default=50,
+                        help='URLs per shard when seeding the queue')
+    parser.add_argument('--lease-seconds', type=float, default=300,
+                        help='Shard lease length; a worker that stops renewing loses its shard after this')
+    parser.add_argument('--max-shard-claims', type=int, default=3,
+                        help='Give up on a shard after its lease has expired this many times')
+    parser.add_argument('--worker-id', help='Name this worker in the shard queue (default host-pid)')
+    parser.add_argument('--metrics-file',
+                        help='Time each stage, add per-record stage columns and write a run summary here '
+                             '(Prometheus text for a .prom file, JSON otherwise)')
+    parser.add_argument('--profile', action='store_true',
+                        help='Sample every thread\'s stack and checkpoint allocations at each flush; writes a '
+                             'collapsed-stack file and an allocation report next to the log file. Allocation '
+                             'tracing slows Python code down roughly twofold')
+    parser.add_argument('--profile-interval', type=float, default=0.01,
+                        help='Seconds between stack samples with --profile')
+    parser.add_argument('--profile-top', type=int, default=25,
+                        help='Allocation sites listed per checkpoint with --profile')
+    parser.add_argument('--warm-drivers', type=int, default=1,
+                        help='Spare Chrome drivers kept started in the background')
+    parser.add_argument('--driver-max-pages', type=int, default=200,
+                        help='Recycle a Chrome driver after this many pages (0 for never)')
+    parser.add_argument('--driver-max-rss-mb', type=float, default=1500,
+                        help='Recycle a Chrome driver once its processes use this much memory (needs psutil)')
+    parser.add_argument('--compression', choices=['zstd', 'snappy', 'gzip', 'brotli', 'lz4', 'none'],
+                        default='zstd', help='Parquet compression codec')
     parser.add_argument('--log-file', required=True)
+    parser.add_argument('--log-format', choices=['text', 'json'], default='text',
+                        help='Write the log file as plain text or JSON lines')
+    verbosity = parser.add_mutually_exclusive_group()
+    verbosity.add_argument('--quiet', action='store_true',
+                           help='Only log warnings and errors, without a progress bar')
+    verbosity.add_argument('--verbose', action='store_true', help='Also log every page processed')
+    parser.add_argument('--sync-logging', action='store_true',
+                        help='Write log lines on the calling thread instead of a background writer')
     parser.add_argument('--output-file', help='GitHub Actions output file')
     args = parser.parse_args()
+    if args.resume and not args.cache_file:
+        parser.error('--resume requires --cache-file')
+    if args.refresh and not args.cache_file:
+        parser.error('--refresh requires --cache-file')
+    if args.refresh and args.resume:
+        parser.error('--refresh and --resume cannot be combined')
+    if args.resume and args.engine == 'async':
+        parser.error('--resume is not supported with --engine async')
     
     # Setup
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
-    logger = setup_logging(args.log_file)
+    level = logging.WARNING if args.quiet else logging.DEBUG if args.verbose else logging.INFO
+    logger = setup_logging(args.log_file, level, json_format=args.log_format == 'json',
+                           background=not args.sync_logging, name=__name__)
+    if args.metrics_file:
+        metrics.enable()
+    if args.profile:
+        profiler.enable(args.log_file, interval=args.profile_interval, top=args.profile_top)
     
     try:
-        # Get latest data file
-        data_file = get_latest_data_file()
-        logger.info(f"Using data file: {data_file}")
-        
-        # Load URLs
-        with open(data_file) as f:
-            data = json.load(f)
-            
-        urls = [record['url'] for record in data if record.get('url')]
-        total_available = len(urls)
-        logger.info(f"Found {total_available} URLs to process")
-        
         # Convert inputs to integers and validate
         try:
             total_processed = int(args.total_processed)
@@ -443,18 +871,41 @@ def main():
             
         logger.info(f"Starting with: index={start_index}, processed={total_processed}, target={total_target}")
         
+        if total_target > 0 and total_processed >= total_target and not args.build_index:
+            # Nothing is left whatever the data file holds, so do not open it
+            return report_no_work(args.output_file, logger, start_index, total_processed, total_target)
+        
+        # A plan with an explicit target needs no URL count unless URLs are selected by ID
+        urls = None
+        total_available = None
+        if not args.plan_only or args.build_index or args.id_file or total_target <= 0:
+            from url_source import open_url_source
+            
+            # Get latest data file
+            data_file = get_latest_data_file()
+            logger.info(f"Using data file: {data_file}")
+            
+            # Open URLs through the sidecar index so only the requested range is read
+            urls = open_url_source(data_file, logger)
+            if args.build_index:
+                logger.info(f"URL index ready with {len(urls)} URLs")
+                return 0
+            if args.id_file:
+                from work_catalog import WorkCatalog, read_id_file
+                
+                # Work on a planned set of media IDs; indexes below are positions in that list
+                ids = read_id_file(args.id_file)
+                urls = WorkCatalog.from_data_file(data_file, logger).urls_for(ids)
+                logger.info(f"Selected {len(urls)} of {len(ids)} media IDs from {args.id_file}")
+            total_available = len(urls)
+            logger.info(f"Found {total_available} URLs to process")
+        
         # Determine total records to process
         total_to_process = total_target if total_target > 0 else total_available
         remaining = total_to_process - total_processed
         
         if remaining <= 0:
-            logger.info(f"Target number of records already processed: {total_processed} of {total_to_process}")
-            if args.output_file:
-                with open(args.output_file, 'a') as f:
-                    f.write("has_more=false\n")
-                    f.write(f"next_index={start_index}\n")
-                    f.write(f"total_processed={total_processed}\n")
-            return 0
+            return report_no_work(args.output_file, logger, start_index, total_processed, total_to_process)
             
         # Adjust max_records if needed
         max_records = min(args.max_records, remaining)
@@ -462,21 +913,179 @@ def main():
         logger.info(f"Total target: {total_to_process}, Remaining: {remaining}")
         logger.info(f"Starting at index {start_index}, processed so far: {total_processed}")
         
+        if args.plan_only:
+            end_index = start_index + max_records
+            if total_available is not None:
+                end_index = min(end_index, total_available)
+            logger.info(f"Planned records {start_index} to {end_index}; exiting without processing")
+            if args.output_file:
+                with open(args.output_file, 'a') as f:
+                    f.write(f"planned_start={start_index}\n")
+                    f.write(f"planned_end={end_index}\n")
+                    f.write(f"planned_records={max(0, end_index - start_index)}\n")
+            return 0
+        
+        cache = None
+        if args.cache_file:
+            cache = ResultCache(
+                args.cache_file,
+                ttl=args.cache_ttl_hours * 3600,
+                max_entries=args.cache_max_entries,
+                logger=logger
+            )
+        max_age = args.refresh_older_than * 3600 if args.refresh_older_than is not None else None
+        
         # Process batch
-        processed = process_url_batch(
-            urls, 
-            output_dir, 
+        try:
+            if args.queue:
+                end_index = min(start_index + remaining, total_available)
+                processed = run_queue(args, urls, output_dir, logger, start_index, end_index,
+                                      total_processed, cache, max_age)
+            else:
+                processed = run_batch(args, urls, output_dir, logger, start_index, total_processed,
+                                      max_records, cache, max_age, output_file=args.output_file)
+        finally:
+            if cache is not None:
+                cache.close()
+        logger.info(f"Processed {processed} records in this batch")
+            
+    except Exception as e:
+        logger.error(f"Fatal error: {e}")
+        raise
+    finally:
+        profiler.finish(logger)
+        if args.metrics_file:
+            metrics.write(args.metrics_file)
+            logger.info(f"Wrote stage metrics to {args.metrics_file}")
+
+def run_batch(args, urls, output_dir, logger, start_index, total_processed, max_records, cache=None, max_age=None,
+              output_file=None, sink=None, pool=None, lease=None):
+    """Dispatch the batch to the engine chosen on the command line"""
+    if args.engine == 'async':
+        return process_url_batch_async(
+            urls,
+            output_dir,
             logger,
             start_index,
             total_processed,
             max_records,
-            args.output_file
+            output_file,
+            flush_rows=args.batch_size,
+            flush_bytes=args.flush_bytes,
+            concurrency=max(1, args.workers),
+            max_concurrency=max(1, args.max_concurrency),
+            rate_limit=args.rate_limit,
+            cache=cache,
+            refresh=args.refresh,
+            max_age=max_age,
+            max_attempts=max(1, args.max_attempts),
+            retry_base_delay=args.retry_base_delay,
+            retry_max_delay=args.retry_max_delay,
+            compression=args.compression,
+            sink=sink,
+            dataset_dir=args.dataset_dir,
+            lease=lease
         )
-        logger.info(f"Processed {processed} records in this batch")
+    
+    return process_url_batch(
+        urls,
+        output_dir,
+        logger,
+        start_index,
+        total_processed,
+        max_records,
+        output_file,
+        flush_rows=args.batch_size,
+        flush_bytes=args.flush_bytes,
+        engine=args.engine,
+        extract_mode=args.extract_mode,
+        workers=max(1, args.workers),
+        cache=cache,
+        resume=args.resume,
+        refresh=args.refresh,
+        max_age=max_age,
+        max_attempts=max(1, args.max_attempts),
+        retry_base_delay=args.retry_base_delay,
+        retry_max_delay=args.retry_max_delay,
+        error_threshold=args.driver_error_threshold,
+        warm_drivers=args.warm_drivers,
+        driver_max_pages=args.driver_max_pages,
+        driver_max_rss_mb=args.driver_max_rss_mb,
+        parse_workers=args.parse_workers,
+        compression=args.compression,
+        sink=sink,
+        dataset_dir=args.dataset_dir,
+        pool=pool,
+        lease=lease
+    )
+
+def run_queue(args, urls, output_dir, logger, start_index, end_index, total_processed, cache=None, max_age=None):
+    """Claim shards from the queue and process them until none are left
+
+    The sink and the driver or session pool are opened once and shared by
+    every shard this worker processes. A shard whose lease is lost midway is
+    abandoned: the worker that reclaimed it writes its records.
+    """
+    shards = open_shard_queue(args.queue, args.lease_seconds, args.max_shard_claims, logger)
+    owner = args.worker_id or f"{socket.gethostname()}-{os.getpid()}"
+    sink = create_sink(output_dir, logger, args.batch_size, args.flush_bytes, args.compression, suffix=owner,
+                       dataset_dir=args.dataset_dir)
+    pool = None
+    if args.engine != 'async':
+        pool = create_pool(args.engine, max(1, args.workers), logger, args.driver_error_threshold,
+                           args.warm_drivers, args.driver_max_pages, args.driver_max_rss_mb)
+    start_time = time.time()
+    processed = 0
+    completed = 0
+    abandoned = 0
+    try:
+        shards.seed(start_index, end_index, args.queue_chunk_size)
+        while True:
+            shard = shards.claim(owner)
+            if shard is None:
+                if not shards.counts().get('leased'):
+                    break
+                # Other workers still hold leases; wait in case one of them dies
+                time.sleep(min(2, args.lease_seconds / 3))
+                continue
             
-    except Exception as e:
-        logger.error(f"Fatal error: {e}")
-        raise
+            logger.info(f"{owner} claimed shard {shard.id} [{shard.start}, {shard.end}) (claim {shard.claims})")
+            with LeaseKeeper(shards, shard, owner, args.lease_seconds / 3, logger) as lease:
+                try:
+                    processed += run_batch(args, urls, output_dir, logger, shard.start, total_processed + processed,
+                                           shard.end - shard.start, cache, max_age, sink=sink, pool=pool,
+                                           lease=lease)
+                except LeaseLost as e:
+                    logger.warning(f"{e}; abandoning it to the worker that reclaimed it")
+                except BaseException:
+                    # Hand the shard straight back rather than waiting for the lease to expire
+                    shards.release(shard, owner)
+                    raise
+            if lease.lost:
+                abandoned += 1
+            elif shards.complete(shard, owner):
+                completed += 1
+        
+        counts = shards.counts()
+        logger.info(f"{owner} finished {completed} shard(s), abandoned {abandoned}; queue state: {counts}")
+        if args.output_file:
+            # The queue has drained, so [start_index, end_index) is covered as in index mode
+            has_more = bool(counts.get('pending') or counts.get('leased')) or end_index < len(urls)
+            with open(args.output_file, 'a') as f:
+                f.write(f"has_more={str(has_more).lower()}\n")
+                f.write(f"next_index={end_index}\n")
+                f.write(f"total_processed={total_processed + processed}\n")
+                f.write(f"shards_completed={completed}\n")
+                f.write(f"shards_failed={counts.get('failed', 0)}\n")
+                f.write(f"shards_abandoned={abandoned}\n")
+                f.write(f"elapsed_seconds={time.time() - start_time:.1f}\n")
+    finally:
+        if pool is not None:
+            pool.close()
+        close_sink(sink, logger)
+        shards.close()
+    
+    return processed
 
 if __name__ == '__main__':
     main() 
@@ -0,0 +1,177 @@
+import hashlib
+import json
+import logging
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+INDEX_SUFFIX = '.urls.parquet'
+INDEX_ROW_GROUP_SIZE = 10000
+FINGERPRINT_BYTES = 64 * 1024
+
+def index_path_for(data_file):
+    """Sidecar index location for a data file"""
+    data_file = Path(data_file)
+    return data_file.with_name(data_file.stem + INDEX_SUFFIX)
+
+def source_fingerprint(data_file):
+    """Cheap fingerprint of a data file: its size plus hashes of its head and tail"""
+    data_file = Path(data_file)
+    size = data_file.stat().st_size
+    digest = hashlib.sha1(str(size).encode())
+    with open(data_file, 'rb') as f:
+        digest.update(f.read(FINGERPRINT_BYTES))
+        if size > FINGERPRINT_BYTES:
+            f.seek(max(FINGERPRINT_BYTES, size - FINGERPRINT_BYTES))
+            digest.update(f.read())
+    return digest.hexdigest()
+
+def iter_json_records(data_file, chunk_size=1024 * 1024):
+    """Yield the elements of a top-level JSON array without loading the whole file"""
+    decoder = json.JSONDecoder()
+    with open(data_file, encoding='utf-8') as f:
+        buf = f.read(chunk_size)
+        pos = len(buf) - len(buf.lstrip())
+        if buf[pos:pos + 1] != '[':
+            raise ValueError(f"{data_file} does not contain a JSON array")
+        pos += 1
+        eof = False
+        while True:
+            # Skip whitespace and separators, reading more when the buffer runs dry
+            while pos < len(buf) and buf[pos] in ' \t\r\n,':
+                pos += 1
+            if pos >= len(buf):
+                if eof:
+                    raise ValueError(f"Unexpected end of {data_file}")
+                more = f.read(chunk_size)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            if buf[pos] == ']':
+                return
+            try:
+                record, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+                more = f.read(chunk_size)
+                eof = not more
+                buf, pos = buf[pos:] + more, 0
+                continue
+            yield record
+            pos = end
+            if pos > chunk_size:
+                buf, pos = buf[pos:], 0
+
+def iter_urls(data_file):
+    """Yield the URL of every record that has one, in file order"""
+    for record in iter_json_records(data_file):
+        if record.get('url'):
+            yield record['url']
+
+def build_url_index(data_file, index_file=None, logger=None):
+    """Stream the data file once and write its URLs to a parquet sidecar index"""
+    logger = logger or logging.getLogger(__name__)
+    index_file = Path(index_file or index_path_for(data_file))
+    schema = pa.schema([('url', pa.string())], metadata={
+        'source_fingerprint': source_fingerprint(data_file)
+    })
+    tmp_file = index_file.with_name(index_file.name + '.tmp')
+    total = 0
+    chunk = []
+    with pq.ParquetWriter(tmp_file, schema, compression='zstd') as writer:
+        for url in iter_urls(data_file):
+            chunk.append(url)
+            if len(chunk) >= INDEX_ROW_GROUP_SIZE:
+                writer.write_table(pa.table({'url': chunk}, schema=schema))
+                total += len(chunk)
+                chunk = []
+        if chunk:
+            writer.write_table(pa.table({'url': chunk}, schema=schema))
+            total += len(chunk)
+    tmp_file.replace(index_file)
+    logger.info(f"Built URL index {index_file} with {total} URLs")
+    return index_file
+
+def index_is_fresh(data_file, index_file):
+    """Check that an index exists and was built from the current data file"""
+    index_file = Path(index_file)
+    if not index_file.exists():
+        return False
+    try:
+        metadata = pq.read_schema(index_file).metadata or {}
+    except Exception:
+        return False
+    return metadata.get(b'source_fingerprint', b'').decode() == source_fingerprint(data_file)
+
+
+class IndexedUrlSource:
+    """URL list backed by a parquet index; slices read only the row groups they cover"""
+
+    def __init__(self, index_file):
+        self.index_file = Path(index_file)
+        self._file = pq.ParquetFile(self.index_file)
+        metadata = self._file.metadata
+        self._offsets = [0]
+        for i in range(metadata.num_row_groups):
+            self._offsets.append(self._offsets[-1] + metadata.row_group(i).num_rows)
+
+    def __len__(self):
+        return self._offsets[-1]
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError(key)
+            return self[key:key + 1][0]
+        start, stop, step = key.indices(len(self))
+        if start >= stop:
+            return []
+        groups = [i for i in range(len(self._offsets) - 1)
+                  if self._offsets[i] < stop and self._offsets[i + 1] > start]
+        table = self._file.read_row_groups(groups, columns=['url'])
+        first = self._offsets[groups[0]]
+        return table.column('url').slice(start - first, stop - start).to_pylist()[::step]
+
+
+class StreamingUrlSource:
+    """URL list read straight from the JSON file, streaming up to the requested range"""
+
+    def __init__(self, data_file):
+        self.data_file = Path(data_file)
+        self._length = None
+
+    def __len__(self):
+        if self._length is None:
+            self._length = sum(1 for _ in iter_urls(self.data_file))
+        return self._length
+
+    def __getitem__(self, key):
+        if isinstance(key, int):
+            return self[key:key + 1][0]
+        if (key.start is not None and key.start < 0) or key.stop is None or key.stop < 0:
+            return list(iter_urls(self.data_file))[key]
+        urls = []
+        for i, url in enumerate(iter_urls(self.data_file)):
+            if i >= key.stop:
+                break
+            urls.append(url)
+        return urls[key]
+
+def open_url_source(data_file, logger=None, build_index=True):
+    """Open the fastest available URL source for a data file, building its index if needed"""
+    logger = logger or logging.getLogger(__name__)
+    index_file = index_path_for(data_file)
+    if index_is_fresh(data_file, index_file):
+        logger.info(f"Using URL index {index_file}")
+        return IndexedUrlSource(index_file)
+    if build_index:
+        try:
+            return IndexedUrlSource(build_url_index(data_file, index_file, logger))
+        except OSError as e:
+            logger.warning(f"Could not build URL index {index_file}: {e}")
+    logger.info(f"Streaming URLs from {data_file}")
+    return StreamingUrlSource(data_file)
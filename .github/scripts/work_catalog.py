@@ -0,0 +1,184 @@
+import re
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from url_source import INDEX_SUFFIX, index_is_fresh, index_path_for, build_url_index
+
+MEDIA_ID_PATTERN = r'/concern/media/0*(?P<id>\d+)'
+MEDIA_ID_RE = re.compile(MEDIA_ID_PATTERN)
+SHARD_MODES = ('contiguous', 'balanced')
+
+def setup_logging(level=logging.INFO):
+    """Configure logging for the script"""
+    logging.basicConfig(
+        level=level,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.StreamHandler()
+        ]
+    )
+    return logging.getLogger(__name__)
+
+def media_ids(urls):
+    """Media IDs of an array of media page URLs, with -1 where a URL has none"""
+    urls = pa.array(urls, type=pa.string()) if not isinstance(urls, (pa.Array, pa.ChunkedArray)) else urls
+    digits = pc.struct_field(pc.extract_regex(urls, MEDIA_ID_PATTERN), [0])
+    return pc.fill_null(pc.cast(digits, pa.int64()), -1).to_numpy(zero_copy_only=False)
+
+def media_id(url):
+    """Media ID of one media page URL, or None; the per-record counterpart of media_ids"""
+    match = MEDIA_ID_RE.search(url)
+    return int(match.group('id')) if match else None
+
+def read_id_file(path):
+    """Media IDs from a .npy file or a text file with one ID per line"""
+    path = Path(path)
+    if path.suffix == '.npy':
+        return np.load(path).astype(np.int64)
+    return np.loadtxt(path, dtype=np.int64, ndmin=1)
+
+def write_id_file(path, ids):
+    path = Path(path)
+    if path.suffix == '.npy':
+        np.save(path, ids)
+    else:
+        np.savetxt(path, ids, fmt='%d')
+
+
+class WorkCatalog:
+    """Every media ID in the input, sorted, with the URL for each.
+
+    Progress is tracked by media ID rather than list position, so a done or
+    failed set stays valid when the input file is reordered or grows.
+    Set arithmetic runs on sorted int64 arrays, which keeps planning over the
+    whole catalog in the milliseconds.
+    """
+
+    def __init__(self, ids, urls):
+        order = np.argsort(ids, kind='stable')
+        ids = ids[order]
+        urls = urls.take(pa.array(order))
+        # Keep the first URL of any media ID listed twice, and drop URLs without one
+        keep = np.ones(len(ids), dtype=bool)
+        keep[1:] = ids[1:] != ids[:-1]
+        keep &= ids >= 0
+        self.ids = ids[keep]
+        self.urls = urls.filter(pa.array(keep))
+
+    @classmethod
+    def from_data_file(cls, data_file, logger=None):
+        """Catalog of a data file, read through its URL index"""
+        index_file = index_path_for(data_file)
+        if not index_is_fresh(data_file, index_file):
+            build_url_index(data_file, index_file, logger)
+        urls = pq.read_table(index_file, columns=['url']).column('url').combine_chunks()
+        return cls(media_ids(urls), urls)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def urls_for(self, ids):
+        """URLs of the given media IDs, in the order given; IDs not in the catalog are left out"""
+        ids = np.asarray(ids, dtype=np.int64)
+        positions = np.searchsorted(self.ids, ids)
+        found = positions < len(self.ids)
+        found[found] = self.ids[positions[found]] == ids[found]
+        return self.urls.take(pa.array(positions[found])).to_pylist()
+
+    def pending(self, done=None, failed=None):
+        """Media IDs neither done nor permanently failed"""
+        finished = np.union1d(
+            done if done is not None else np.empty(0, np.int64),
+            failed if failed is not None else np.empty(0, np.int64))
+        return np.setdiff1d(self.ids, finished, assume_unique=True)
+
+def done_ids(output_dirs, logger=None):
+    """Media IDs of every record in the parquet files under output_dirs, reading only their url column"""
+    logger = logger or logging.getLogger(__name__)
+    chunks = [np.empty(0, np.int64)]
+    files = 0
+    for output_dir in output_dirs:
+        for path in Path(output_dir).rglob('*.parquet'):
+            if path.name.endswith(INDEX_SUFFIX):
+                continue
+            try:
+                if 'url' not in pq.read_schema(path).names:
+                    continue
+                chunks.append(media_ids(pq.read_table(path, columns=['url']).column('url')))
+                files += 1
+            except Exception as e:
+                logger.warning(f"Skipping unreadable output {path}: {e}")
+    logger.debug(f"Read record URLs from {files} output file(s)")
+    return np.unique(np.concatenate(chunks))
+
+def failed_ids(output_dirs, reasons=('permanent',)):
+    """Media IDs the processor gave up on for one of `reasons`, from its skipped_records files"""
+    urls = []
+    for output_dir in output_dirs:
+        for path in Path(output_dir).rglob('skipped_records_*.json'):
+            with open(path) as f:
+                urls.extend(r['url'] for r in json.load(f) if r.get('reason') in reasons)
+    if not urls:
+        return np.empty(0, np.int64)
+    return np.unique(media_ids(urls))
+
+def split_shards(ids, count, mode='contiguous'):
+    """Split sorted IDs into `count` shards of near-equal size
+
+    contiguous shards cover consecutive ID ranges; balanced shards take
+    every count-th ID, so each mixes old and new media and costs about the
+    same to process.
+    """
+    count = max(1, min(count, len(ids))) if len(ids) else 1
+    if mode == 'balanced':
+        return [ids[i::count] for i in range(count)]
+    return np.array_split(ids, count)
+
+def main():
+    parser = argparse.ArgumentParser(description='Plan the media IDs still to process from existing outputs')
+    parser.add_argument('--data-file', default='data/morphosource_data_complete.json')
+    parser.add_argument('--outputs', nargs='*', default=['data/processed_parquet'],
+                        help='Directories holding earlier processor outputs')
+    parser.add_argument('--retry-failed', action='store_true',
+                        help='Plan permanently failed IDs again instead of leaving them out')
+    parser.add_argument('--shards', type=int, default=1)
+    parser.add_argument('--mode', choices=SHARD_MODES, default='contiguous')
+    parser.add_argument('--output-dir', default='shards', help='Where to write shard_<n>.npy ID files')
+    parser.add_argument('--format', choices=['npy', 'txt'], default='npy')
+    parser.add_argument('--output-file', help='GitHub Actions output file')
+    args = parser.parse_args()
+
+    logger = setup_logging()
+    catalog = WorkCatalog.from_data_file(args.data_file, logger)
+    start = time.perf_counter()
+    done = done_ids(args.outputs, logger)
+    failed = None if args.retry_failed else failed_ids(args.outputs)
+    pending = catalog.pending(done, failed)
+    shards = split_shards(pending, args.shards, args.mode)
+    elapsed = time.perf_counter() - start
+    logger.info(f"{len(catalog)} media IDs: {len(np.intersect1d(catalog.ids, done, assume_unique=True))} done, "
+                f"{0 if failed is None else len(failed)} failed, {len(pending)} pending "
+                f"(planned in {elapsed * 1000:.0f} ms)")
+
+    output_dir = Path(args.output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    for i, shard in enumerate(shards):
+        write_id_file(output_dir / f'shard_{i}.{args.format}', shard)
+        if len(shard):
+            logger.info(f"Shard {i}: {len(shard)} IDs from {shard.min()} to {shard.max()}")
+    if args.output_file:
+        with open(args.output_file, 'a') as f:
+            f.write(f"pending={len(pending)}\n")
+            f.write(f"shards={len(shards)}\n")
+    return 0
+
+if __name__ == '__main__':
+    raise SystemExit(main())